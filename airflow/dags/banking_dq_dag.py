@@ -1,6 +1,37 @@
 from datetime import datetime, timedelta
 from airflow import DAG
-from airflow.operators.bash import BashOperator
+from airflow.operators.python import PythonOperator
+
+# The scripts run inside the task process instead of new interpreters, so a task
+# starts no second interpreter; connections are still opened per task instance,
+# since Airflow runs each one in a new process. Modules pulling in NumPy, pandas,
+# pyarrow or Faker are imported by the callables, not when the scheduler parses
+# this file; data_quality_standards is light and its CHECKS shape the DAG.
+import data_quality_standards as dq
+
+# The wrappers take explicit parameters: a callable with **kwargs would be
+# handed the whole task context by Airflow.
+def generate_all():
+    from generate_data import generate_all
+    return generate_all()
+
+# One process: LocalExecutor task processes are daemonic and cannot start a
+# multiprocessing.Pool, so workers stays 1 here.
+def process_pending_transactions(checkpointed=False):
+    from monitoring_audit import run
+    return run(workers=1, checkpointed=checkpointed)
+
+def run_scoring():
+    from risk_scoring import run_scoring
+    return run_scoring()
+
+def run_export():
+    from export_parquet import run_export
+    return run_export()
+
+def maintain_partitions(archive=False):
+    from partitions import maintain_partitions
+    return maintain_partitions(archive=archive)
 
 default_args = {
     'owner': 'banking-data',
@@ -19,20 +50,47 @@ with DAG(
     tags=['banking','dq']
 ) as dag:
 
-    t1_generate = BashOperator(
+    t1_generate = PythonOperator(
         task_id='generate_data',
-        bash_command='python3 /opt/airflow/src/generate_data.py'
+        python_callable=generate_all,
     )
 
-    t2_quality = BashOperator(
-        task_id='data_quality_checks',
-        bash_command='python3 /opt/airflow/src/data_quality_standards.py'
+    t2_watermarks = PythonOperator(
+        task_id='prepare_watermarks',
+        python_callable=dq.ensure_watermark_table,
     )
 
-    t3_risk = BashOperator(
+    # one mapped task per table, running in parallel (each on its own pooled connection)
+    t2_quality = PythonOperator.partial(
+        task_id='data_quality_checks',
+        python_callable=dq.check_table,
+    ).expand(op_kwargs=[{'table': table, 'incremental': True} for table in dq.CHECKS])
+
+    t3_risk = PythonOperator(
         task_id='monitoring',
-        bash_command='python3 /opt/airflow/src/monitoring_audit.py'
+        python_callable=process_pending_transactions,
+        op_kwargs={'checkpointed': True},       # same mode as the minute DAG and the processor service
+    )
+
+    t3_scoring = PythonOperator(
+        task_id='risk_scoring',
+        python_callable=run_scoring,
+    )
+
+    t4_export = PythonOperator(
+        task_id='export_parquet',
+        python_callable=run_export,
+    )
+
+    t5_archive = PythonOperator(
+        task_id='partition_maintenance',
+        python_callable=maintain_partitions,
+        op_kwargs={'archive': True},
     )
 
-    # Define execution order
-    t1_generate >> t2_quality >> t3_risk
\ No newline at end of file
+    # Define execution order: the checks only read, so they overlap with settlement;
+    # batch scoring follows settlement; export waits for both branches, and runs
+    # before archiving so detached partitions have been snapshotted
+    t1_generate >> t2_watermarks >> t2_quality
+    t1_generate >> t3_risk >> t3_scoring
+    [t2_quality, t3_scoring] >> t4_export >> t5_archive
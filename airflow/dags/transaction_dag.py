@@ -1,10 +1,11 @@
 from datetime import timedelta
 from airflow import DAG
 from airflow.operators.python import PythonOperator
-from airflow.operators.bash import BashOperator
 from airflow.utils.dates import days_ago
 
-from generate_data import generate_transaction
+import metrics
+
+SHARDS = 4      # processing tasks mapped per run, one shard of the pending queue each
 
 default_args = {
     'owner': 'airflow',
@@ -13,6 +14,22 @@ default_args = {
     'retry_delay': timedelta(minutes=1),
 }
 
+# Task callables return a metrics summary, pushed to XCom (empty unless METRICS_ENABLED).
+# The pipeline modules (NumPy, Faker) are imported when a task runs, not when
+# the scheduler parses this file.
+def generate_with_metrics(n):
+    from generate_data import generate_transaction
+    generate_transaction(n)
+    return metrics.summary()
+
+# One shard per mapped task: LocalExecutor task processes are daemonic and cannot
+# start the multiprocessing.Pool that monitoring_audit.run uses for workers > 1.
+def process_with_metrics(shard, n_shards, batch_settlement, checkpointed=False):
+    from monitoring_audit import run_worker
+    processed, failed, _ = run_worker(shard, n_shards, batch_settlement=batch_settlement,
+                                      checkpointed=checkpointed)
+    return {'shard': shard, 'processed': processed, 'failed': failed, **metrics.summary()}
+
 with DAG(
     dag_id='generate_transaction_every_minute',
     default_args=default_args,
@@ -25,11 +42,13 @@ with DAG(
 
     run_transaction = PythonOperator(
         task_id='run_generate_transaction',
-        python_callable=generate_transaction,   
+        python_callable=generate_with_metrics,
         op_kwargs={'n': 1000},                 
     )
-    run_prosessing = BashOperator(
+    # checkpointed: a run killed mid-batch is resumed by the next minute's run
+    run_prosessing = PythonOperator.partial(
         task_id='run_processing',
-        bash_command='python3 /opt/airflow/src/monitoring_audit.py'
-    )
+        python_callable=process_with_metrics,
+    ).expand(op_kwargs=[{'shard': shard, 'n_shards': SHARDS, 'batch_settlement': True, 'checkpointed': True}
+                        for shard in range(SHARDS)])
     run_transaction >> run_prosessing
@@ -0,0 +1,351 @@
+"""
+run_benchmarks.py
+
+Throughput benchmarks for data generation, transaction settlement and data
+quality checks against a throwaway local PostgreSQL cluster.
+
+The cluster is created with initdb in a temp directory (binaries from PATH,
+PG_BIN or `pg_config --bindir`), loaded with sql/schema.sql, seeded once per
+scale and cloned from a template database before every stage so each stage
+starts from the same data. Results are written as JSON for comparison across
+commits:
+
+    python benchmarks/run_benchmarks.py --scale small --scale customers=10000,transactions=100000
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/<old>.json
+
+--verify-procedure settles the same seeded data once with the Python processor
+and once with the banking.settle_transactions stored procedure and fails if
+statuses, balances, auth_log or risk_tag rows differ.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.extensions
+
+ROOT        = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR     = os.path.join(ROOT, "src")
+SQL_FILES   = [os.path.join(ROOT, "sql", "schema.sql"), os.path.join(ROOT, "sql", "settlement.sql")]
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+DB_NAME     = "banking"
+SEED_DB     = "banking_seed"
+# initdb and pg_ctl refuse to run as root; as root they run as this OS user instead
+PG_OS_USER  = os.getenv("PG_OS_USER", "postgres")
+
+# Cursor that counts statements sent to the server.
+class CountingCursor(psycopg2.extensions.cursor):
+    queries = 0
+
+    def execute(self, query, vars=None):
+        CountingCursor.queries += 1
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        CountingCursor.queries += 1
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        CountingCursor.queries += 1
+        return super().copy_expert(sql, file, size)
+
+def _pg_bin(name):
+    if os.getenv("PG_BIN"):
+        return os.path.join(os.environ["PG_BIN"], name)
+    if shutil.which(name):
+        return shutil.which(name)
+    if shutil.which("pg_config"):
+        bindir = subprocess.check_output(["pg_config", "--bindir"], text=True).strip()
+        return os.path.join(bindir, name)
+    raise RuntimeError(f"{name} not found; put PostgreSQL binaries on PATH or set PG_BIN")
+
+# OS user the cluster runs as when started by root: PG_OS_USER if it exists, else nobody.
+def _cluster_user():
+    import pwd
+    for name in (PG_OS_USER, "nobody"):
+        try:
+            return pwd.getpwnam(name)
+        except KeyError:
+            continue
+    raise RuntimeError(f"no OS user {PG_OS_USER!r} or 'nobody' to run PostgreSQL as")
+
+# True when the cluster binaries can be started here: as a regular user, or as
+# root through runuser.
+def can_start_cluster():
+    try:
+        _pg_bin("initdb")
+    except RuntimeError:
+        return False
+    return os.geteuid() != 0 or bool(shutil.which("runuser"))
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+# Start a throwaway cluster and point the POSTGRES_* variables at it.
+# Durability is switched off: the cluster is deleted afterwards anyway.
+@contextmanager
+def local_postgres():
+    data_dir = tempfile.mkdtemp(prefix="banking-bench-")
+    port = _free_port()
+    run_as = []
+    if os.geteuid() == 0:
+        user = _cluster_user()
+        os.chown(data_dir, user.pw_uid, user.pw_gid)
+        run_as = ["runuser", "-u", user.pw_name, "--"]
+    subprocess.run(run_as + [_pg_bin("initdb"), "-D", data_dir, "-U", "postgres", "--auth=trust"],
+                   check=True, stdout=subprocess.DEVNULL)
+    options = (f"-p {port} -c listen_addresses=127.0.0.1 -k {data_dir} "
+               "-c fsync=off -c synchronous_commit=off -c full_page_writes=off")
+    subprocess.run(run_as + [_pg_bin("pg_ctl"), "-D", data_dir, "-o", options, "-w",
+                             "-l", os.path.join(data_dir, "server.log"), "start"],
+                   check=True, stdout=subprocess.DEVNULL)
+    os.environ.update({
+        "POSTGRES_HOST": "127.0.0.1",
+        "POSTGRES_PORT": str(port),
+        "POSTGRES_DB": DB_NAME,
+        "POSTGRES_USER": "postgres",
+        "POSTGRES_PASSWORD": "",
+    })
+    try:
+        yield port
+    finally:
+        subprocess.run(run_as + [_pg_bin("pg_ctl"), "-D", data_dir, "-m", "immediate", "stop"],
+                       stdout=subprocess.DEVNULL)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def _admin(port, statement):
+    conn = psycopg2.connect(host="127.0.0.1", port=port, dbname="postgres", user="postgres")
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(statement)
+    conn.close()
+
+# Recreate the working database, empty with the schema or as a copy of the seed.
+def reset_database(port, template=None):
+    import db
+    db.close_pool()         # pooled sessions would block DROP DATABASE
+    _admin(port, f"DROP DATABASE IF EXISTS {DB_NAME};")
+    if template:
+        _admin(port, f"CREATE DATABASE {DB_NAME} TEMPLATE {template};")
+        return
+    _admin(port, f"CREATE DATABASE {DB_NAME};")
+    conn = psycopg2.connect(host="127.0.0.1", port=port, dbname=DB_NAME, user="postgres")
+    with conn, conn.cursor() as cur:
+        for path in SQL_FILES:
+            with open(path) as f:
+                cur.execute(f.read())
+    conn.close()
+
+def save_as_template(port):
+    import db
+    db.close_pool()
+    _admin(port, f"DROP DATABASE IF EXISTS {SEED_DB};")
+    _admin(port, f"CREATE DATABASE {SEED_DB} TEMPLATE {DB_NAME};")
+
+# Import the pipeline modules once the environment points at the local cluster,
+# and make every connection they open, pooled or not, count its statements.
+def load_modules():
+    sys.path.insert(0, SRC_DIR)
+    import db, generate_data, monitoring_audit, data_quality_standards
+    params = db.connection_params
+    db.connection_params = lambda: dict(params(), cursor_factory=CountingCursor)
+    return generate_data, monitoring_audit, data_quality_standards
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+def _stage_result(items, elapsed, queries, latencies=None):
+    result = {
+        "items": items,
+        "seconds": round(elapsed, 4),
+        "per_second": round(items / elapsed, 2) if elapsed else None,
+        "queries": queries,
+    }
+    if latencies:
+        result["p50_ms"] = round(_percentile(latencies, 50) * 1000, 3)
+        result["p99_ms"] = round(_percentile(latencies, 99) * 1000, 3)
+    return result
+
+# Time a callable and count the statements it sends.
+def measure(fn, *args, **kwargs):
+    CountingCursor.queries = 0
+    start = time.perf_counter()
+    value = fn(*args, **kwargs)
+    return value, time.perf_counter() - start, CountingCursor.queries
+
+def bench_generation(generate_data, scale, seed):
+    conn = generate_data.connect_db()
+    with conn, conn.cursor() as cur:
+        _, elapsed, queries = measure(generate_data.generate_scaled, cur, scale, seed)
+    conn.close()
+    rows = scale.transactions + scale.customers
+    return _stage_result(rows, elapsed, queries)
+
+# Wrap process_transaction to record per-transaction latency.
+def bench_settlement(monitoring_audit, seed, batch_settlement=False, procedure=False, checkpointed=False):
+    latencies = []
+    original = monitoring_audit.process_transaction
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    monitoring_audit.process_transaction = timed
+    random.seed(seed)
+    try:
+        (processed, failed), elapsed, queries = measure(
+            monitoring_audit.run, 1, monitoring_audit.BATCH_SIZE, batch_settlement,
+            procedure=procedure, checkpointed=checkpointed)
+    finally:
+        monitoring_audit.process_transaction = original
+    return _stage_result(processed + failed, elapsed, queries, latencies)
+
+# Time each table's checks, then the whole concurrent run.
+def bench_data_quality(dq):
+    latencies = []
+    for table in dq.CHECKS:
+        start = time.perf_counter()
+        dq.run_table_checks(table)
+        latencies.append(time.perf_counter() - start)
+    results, elapsed, queries = measure(dq.run_checks)
+    return _stage_result(len(results), elapsed, queries, latencies)
+
+# Settlement outcome in comparable form; generated ids (auth_id, risk_id) are left out.
+OUTCOME_QUERIES = {
+    "transaction": "SELECT tx_id, status FROM banking.transaction ORDER BY tx_id",
+    "account":     "SELECT account_id, balance FROM banking.account ORDER BY account_id",
+    "auth_log":    "SELECT tx_id, auth_type, success_flag FROM banking.auth_log ORDER BY 1, 2, 3",
+    "risk_tag":    "SELECT tx_id, severity, tag_reason FROM banking.risk_tag ORDER BY 1, 2, 3",
+}
+
+def settlement_outcome():
+    conn = psycopg2.connect(host="127.0.0.1", port=os.environ["POSTGRES_PORT"],
+                            dbname=DB_NAME, user="postgres")
+    with conn, conn.cursor() as cur:
+        outcome = {}
+        for table, query in OUTCOME_QUERIES.items():
+            cur.execute(query)
+            outcome[table] = cur.fetchall()
+    conn.close()
+    return outcome
+
+# Settle the seeded data with the Python path and with the stored procedure and
+# compare the results table by table. Authentication is seeded per tx_id so both
+# paths see the same outcomes.
+def verify_procedure(port, monitoring_audit, seed):
+    monitoring_audit.AUTH_SEED = str(seed)
+    outcomes = []
+    try:
+        for procedure in (False, True):
+            reset_database(port, SEED_DB)
+            monitoring_audit.run(1, monitoring_audit.BATCH_SIZE, procedure=procedure)
+            outcomes.append(settlement_outcome())
+    finally:
+        monitoring_audit.AUTH_SEED = None
+    python, stored = outcomes
+    mismatches = {table: len(set(python[table]) ^ set(stored[table])) for table in OUTCOME_QUERIES}
+    return {"identical": not any(mismatches.values()), "mismatched_rows": mismatches}
+
+def run_scale(port, modules, scale, seed, verify=False):
+    generate_data, monitoring_audit, dq = modules
+    results = {}
+    reset_database(port)
+    results["generation"] = bench_generation(generate_data, scale, seed)
+    save_as_template(port)
+
+    reset_database(port, SEED_DB)
+    results["settlement"] = bench_settlement(monitoring_audit, seed)
+    reset_database(port, SEED_DB)
+    results["settlement_batch"] = bench_settlement(monitoring_audit, seed, batch_settlement=True)
+    reset_database(port, SEED_DB)
+    results["settlement_procedure"] = bench_settlement(monitoring_audit, seed, procedure=True)
+    reset_database(port, SEED_DB)
+    results["settlement_checkpointed"] = bench_settlement(monitoring_audit, seed, checkpointed=True)
+
+    # DQ runs over settled data so auth_log and risk_tag are populated
+    results["data_quality"] = bench_data_quality(dq)
+
+    if verify:
+        results["procedure_equivalence"] = verify_procedure(port, monitoring_audit, seed)
+    return results
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+# Print per-stage throughput of a run next to an earlier one.
+def compare(current, baseline):
+    print(f"{'scale':<40} {'stage':<18} {'before/s':>12} {'after/s':>12} {'change':>8}")
+    for scale, stages in current["scales"].items():
+        for stage, result in stages.items():
+            before = baseline.get("scales", {}).get(scale, {}).get(stage)
+            if not before or not before.get("per_second") or not result.get("per_second"):
+                continue
+            change = result["per_second"] / before["per_second"] - 1
+            print(f"{scale:<40} {stage:<18} {before['per_second']:>12.1f} "
+                  f"{result['per_second']:>12.1f} {change:>+8.1%}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the banking data pipeline.")
+    parser.add_argument("--scale", action="append",
+                        help="preset or 'customers=N,transactions=N' (repeatable, default: small)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="result file (default: benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    parser.add_argument("--verify-procedure", action="store_true",
+                        help="check the stored procedure settles like the Python path (exit 1 if not)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    with local_postgres() as port:
+        modules = load_modules()
+        from synthetic_data import parse_scale
+        report = {
+            "commit": git_commit(),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "seed": args.seed,
+            "scales": {},
+        }
+        for name in args.scale or ["small"]:
+            report["scales"][name] = run_scale(port, modules, parse_scale(name), args.seed,
+                                               args.verify_procedure)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{report['commit']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"Results saved to {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+    if any(not stages.get("procedure_equivalence", {"identical": True})["identical"]
+           for stages in report["scales"].values()):
+        print("Stored procedure settlement differs from the Python path")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
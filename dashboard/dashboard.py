@@ -1,75 +1,27 @@
 import streamlit as st
-import os
-import pandas as pd
+from datetime import date, timedelta
 import altair as alt
-from sqlalchemy import create_engine, text
+import data
 
-# Connect to the database
-DATABASE_URL = os.environ['DATABASE_URL']
-engine = create_engine(DATABASE_URL)
-
-@st.cache_data(ttl=30)
-def query(sql: str) -> pd.DataFrame:
-    return pd.read_sql_query(text(sql), engine)
+PAGE_SIZE = 5
 
 st.title("Banking Dashboard")
 
+# Filters are bound as query parameters; results come from the process-wide
+# cache in data.py and are refreshed when the underlying tables change.
+today = date.today()
+period = st.date_input("Period", value=(today - timedelta(days=30), today))
+period = tuple(period) if isinstance(period, (tuple, list)) else (period,)
+since, until = period[0], period[-1]        # a single day while the range is being picked
+
 st.header("Risky Transactions")
-risky_transactions_sql = """
-                        SELECT tag_reason, severity, count(*) total_failures
-                        FROM banking.risk_tag rt
-                        GROUP BY rt.tag_reason, rt.severity
-                        ORDER BY total_failures DESC;
-                        """
-risky_transactions_df = query(risky_transactions_sql)
+min_severity = st.slider("Minimum severity", min_value=1, max_value=4, value=1)
+risky_transactions_df = data.risky_transactions(since, until, min_severity)
 st.table(risky_transactions_df)
 
-st.header("Top 5 Customers with Most Failures")
-failure_sql = """
-                    -- 1) Aggregate & rank failures by auth_type
-                    WITH failure_auth_counts as (
-                        SELECT auth.auth_type, acc.customer_id, count(*) total_failures
-                        FROM banking.transaction tx
-                        JOIN banking.account acc ON tx.account_id = acc.account_id
-                        JOIN banking.auth_log auth ON tx.tx_id = auth.tx_id
-                        WHERE tx.status = 'failed'
-                        GROUP BY auth.auth_type, acc.customer_id
-                    ),
-                    ranked_failures AS (
-                    SELECT
-                        auth_type as fail_type, customer_id, total_failures,
-                        ROW_NUMBER() OVER (PARTITION BY auth_type ORDER BY total_failures DESC) AS rn
-                    FROM failure_auth_counts
-                    ),
-
-                    -- 2) Select top 5 failures for untrusted devices
-                    untrusted_failures AS (
-                        SELECT acc.customer_id, count(*) total_failures
-                        FROM banking.risk_tag rt
-                        JOIN banking.transaction tx on rt.tx_id = tx.tx_id
-                        JOIN banking.account acc on tx.account_id = acc.account_id
-                        WHERE rt.severity = 4
-                        GROUP BY acc.customer_id
-                    ),
-                    ranked_unstrusted AS (
-                        SELECT 'UNTRUSTED DEVICES' AS fail_type, customer_id, total_failures,
-                        ROW_NUMBER() OVER (ORDER BY total_failures DESC) AS rn
-                    FROM untrusted_failures
-                    )
-
-                    -- 3) Combine results and select top 5 for each auth_type
-                    SELECT fail_type, customer_id, total_failures
-                    FROM ranked_failures
-                    WHERE rn <= 5
-
-                    UNION ALL
-
-                    SELECT fail_type, customer_id, total_failures
-                    FROM ranked_unstrusted
-                    WHERE rn <= 5
-                    ORDER BY fail_type, total_failures DESC;
-                    """
-failure_df = query(failure_sql)
+st.header(f"Top {PAGE_SIZE} Customers with Most Failures")
+page = st.number_input("Page", min_value=1, value=1, step=1)
+failure_df = data.top_failures(since, until, limit=PAGE_SIZE, offset=(int(page) - 1) * PAGE_SIZE)
 st.table(failure_df)
 
 # Visualize the top 5 customers with most failures
@@ -0,0 +1,225 @@
+"""
+data.py
+
+Query layer of the dashboard. Streamlit reruns dashboard.py for every viewer
+interaction, but imported modules live for the whole server process, so the
+engine and cache below are shared by all sessions:
+
+  - one SQLAlchemy engine with a small, pre-pinged pool;
+  - a result cache keyed by (query, parameters) and tagged with a data version,
+    so results stay valid until the data changes instead of for a fixed TTL;
+  - single-flight: concurrent viewers asking for the same missing result wait
+    for one query instead of each running it.
+
+The data version is the sum of pg_stat_user_tables insert/update/delete
+counters of transaction, risk_tag (all partitions) and the summary tables on
+PostgreSQL, or the modification times of the export directories on DuckDB. It
+is probed at most every VERSION_INTERVAL seconds per process.
+
+Cached frames are shared between sessions and must not be modified in place.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+# 'postgres' reads the summary tables; 'duckdb' queries the Parquet snapshots
+# written by src/export_parquet.py, keeping analytical scans off the database.
+BACKEND          = os.getenv("DASHBOARD_BACKEND", "postgres")
+EXPORT_DIR       = os.getenv("EXPORT_DIR", "/exports")
+CACHE_SIZE       = int(os.getenv("DASHBOARD_CACHE_SIZE", 256))           # cached results per process
+VERSION_INTERVAL = float(os.getenv("DASHBOARD_VERSION_INTERVAL", 2))     # seconds between version probes
+POOL_SIZE        = int(os.getenv("DASHBOARD_POOL_SIZE", 5))
+POOL_OVERFLOW    = int(os.getenv("DASHBOARD_POOL_OVERFLOW", 5))
+
+_lock     = threading.Lock()
+_cache    = OrderedDict()     # key -> (version, DataFrame), least recently used first
+_inflight = {}                # key -> lock held by the session running that query
+_version  = [None, 0.0]       # last data version, monotonic time it was probed
+
+if BACKEND == "duckdb":
+    import duckdb
+
+    def parquet(table: str) -> str:
+        return f"read_parquet('{EXPORT_DIR}/{table}/*/*.parquet', hive_partitioning = true)"
+
+    def _run(sql: str, params: dict) -> pd.DataFrame:
+        with duckdb.connect() as con:
+            return con.execute(sql, params).df()
+
+    # Exports add or replace files inside date=... directories, which updates
+    # their modification times.
+    def _probe_version():
+        stamp = 0
+        for table in ("transaction", "auth_log", "risk_tag", "account"):
+            try:
+                with os.scandir(os.path.join(EXPORT_DIR, table)) as entries:
+                    stamp = max([stamp] + [e.stat().st_mtime_ns for e in entries if e.is_dir()])
+            except FileNotFoundError:
+                continue
+        return stamp
+else:
+    DATABASE_URL = os.environ['DATABASE_URL']
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=POOL_SIZE,
+        max_overflow=POOL_OVERFLOW,
+        pool_timeout=10,
+        pool_recycle=1800,
+        pool_pre_ping=True,
+    )
+
+    VERSION_SQL = text("""
+        SELECT coalesce(sum(n_tup_ins + n_tup_upd + n_tup_del), 0)
+        FROM pg_stat_user_tables
+        WHERE relid IN ('banking.risk_summary'::regclass, 'banking.failure_summary'::regclass)
+           OR relid IN (SELECT inhrelid FROM pg_inherits
+                        WHERE inhparent IN ('banking.transaction'::regclass, 'banking.risk_tag'::regclass));
+    """)
+
+    def _run(sql: str, params: dict) -> pd.DataFrame:
+        return pd.read_sql_query(text(sql), engine, params=params)
+
+    def _probe_version():
+        with engine.connect() as conn:
+            return conn.execute(VERSION_SQL).scalar()
+
+# Current data version; one session probes it per interval, the others reuse it.
+def data_version():
+    now = time.monotonic()
+    with _lock:
+        if _version[0] is not None and now - _version[1] < VERSION_INTERVAL:
+            return _version[0]
+        _version[1] = now           # claim the probe so concurrent sessions skip it
+        previous = _version[0]
+    try:
+        version = _probe_version()
+    except Exception:
+        with _lock:
+            _version[1] = 0.0
+        if previous is None:
+            raise
+        return previous
+    with _lock:
+        _version[0] = version
+    return version
+
+def _cached(key, version):
+    hit = _cache.get(key)
+    if hit is not None and hit[0] == version:
+        _cache.move_to_end(key)
+        return hit[1]
+    return None
+
+# Run a query through the shared cache; params are bound by the driver.
+def query(sql: str, params: dict = None) -> pd.DataFrame:
+    params = params or {}
+    key = (sql, tuple(sorted(params.items())))
+    version = data_version()
+    with _lock:
+        df = _cached(key, version)
+        if df is not None:
+            return df
+        flight = _inflight.setdefault(key, threading.Lock())
+
+    with flight:
+        with _lock:
+            df = _cached(key, version)      # filled while waiting for the flight
+        if df is not None:
+            return df
+        try:
+            df = _run(sql, params)
+        except BaseException:
+            with _lock:
+                _inflight.pop(key, None)
+            raise
+        # store before retiring the flight, under one lock, so a session arriving
+        # in between finds the result instead of starting another query
+        with _lock:
+            _cache[key] = (version, df)
+            _cache.move_to_end(key)
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+            _inflight.pop(key, None)
+    return df
+
+# On PostgreSQL both queries read the pre-aggregated summary tables that
+# sql/schema.sql keeps up to date with triggers, so their cost does not grow
+# with the transaction table. On DuckDB the same figures are computed from the
+# exported rows (as of the last export); the date filters prune partitions.
+
+# Risk tags per reason and severity for days in [since, until].
+def risky_transactions(since, until, min_severity=1) -> pd.DataFrame:
+    if BACKEND == "duckdb":
+        sql = f"""
+            SELECT tag_reason, severity, count(*) total_failures
+            FROM {parquet('risk_tag')}
+            WHERE date BETWEEN $since AND $until AND severity >= $min_severity
+            GROUP BY tag_reason, severity
+            ORDER BY total_failures DESC;
+        """
+    else:
+        sql = """
+            SELECT tag_reason, severity, sum(total) total_failures
+            FROM banking.risk_summary
+            WHERE day BETWEEN :since AND :until AND severity >= :min_severity
+            GROUP BY tag_reason, severity
+            ORDER BY total_failures DESC;
+        """
+    return query(sql, {"since": since, "until": until, "min_severity": min_severity})
+
+# Customers ranked by failures for each fail type over [since, until]; returns
+# ranks offset+1 .. offset+limit of every fail type.
+def top_failures(since, until, limit=5, offset=0) -> pd.DataFrame:
+    if BACKEND == "duckdb":
+        # auth attempts of failed transactions plus untrusted-device tags, as the
+        # failure_summary triggers count them
+        failure_counts_sql = f"""
+            WITH tx AS (
+                SELECT t.tx_id, t.status, a.customer_id
+                FROM {parquet('transaction')} t
+                JOIN {parquet('account')} a ON a.account_id = t.account_id
+                 AND a.date = (SELECT max(date) FROM {parquet('account')})
+                WHERE t.date BETWEEN $since AND $until
+            ),
+            failures AS (
+                SELECT l.auth_type fail_type, tx.customer_id
+                FROM {parquet('auth_log')} l JOIN tx ON tx.tx_id = l.tx_id
+                WHERE tx.status = 'failed'
+                UNION ALL
+                SELECT 'UNTRUSTED DEVICES', tx.customer_id
+                FROM {parquet('risk_tag')} r JOIN tx ON tx.tx_id = r.tx_id
+                WHERE r.severity = 4
+            )
+            SELECT fail_type, customer_id, count(*) total_failures
+            FROM failures
+            GROUP BY fail_type, customer_id
+        """
+        first, last = "$first", "$last"
+    else:
+        failure_counts_sql = """
+            SELECT fail_type, customer_id, sum(total) total_failures
+            FROM banking.failure_summary
+            WHERE day BETWEEN :since AND :until
+            GROUP BY fail_type, customer_id
+        """
+        first, last = ":first", ":last"
+    sql = f"""
+        -- 1) Failures per customer for each auth_type and for untrusted devices
+        WITH failure_counts AS ({failure_counts_sql}),
+        ranked_failures AS (
+            SELECT fail_type, customer_id, total_failures,
+            ROW_NUMBER() OVER (PARTITION BY fail_type ORDER BY total_failures DESC) AS rn
+            FROM failure_counts
+        )
+
+        -- 2) Select the requested page of each fail type
+        SELECT fail_type, customer_id, total_failures
+        FROM ranked_failures
+        WHERE rn BETWEEN {first} AND {last}
+        ORDER BY fail_type, total_failures DESC;
+    """
+    return query(sql, {"since": since, "until": until, "first": offset + 1, "last": offset + limit})
@@ -1,5 +1,6 @@
 -- 1. Create schema and enable extensions
 CREATE SCHEMA IF NOT EXISTS banking;
+CREATE SCHEMA IF NOT EXISTS banking_archive;       -- detached partitions past retention
 SET search_path = banking;
 
 -- 2. Customer table
@@ -33,38 +34,332 @@ CREATE TABLE IF NOT EXISTS device (
 );
 
 -- 5. Transaction table
+-- Range partitioned by day on timestamp (see ensure_partitions below), so the
+-- primary key includes timestamp and other tables cannot hold a FK to tx_id;
+-- that integrity is checked by data_quality_standards.py instead.
 CREATE TABLE IF NOT EXISTS transaction (
-  tx_id        UUID             PRIMARY KEY DEFAULT gen_random_uuid(),
+  tx_id        UUID             NOT NULL DEFAULT gen_random_uuid(),
   account_id   UUID             NOT NULL REFERENCES account(account_id),
   device_id    UUID,                           -- for tracking
   target_id    UUID,                           -- for transfers, can be NULL for deposits/withdrawals
   amount       NUMERIC(18,2)    NOT NULL,
   method       VARCHAR(20)      NOT NULL,      -- 'online', 'card', etc.
   status       VARCHAR(10)      NOT NULL,      -- 'pending', 'posted', 'failed'
-  timestamp    TIMESTAMPTZ      NOT NULL DEFAULT now()
-);
+  timestamp    TIMESTAMPTZ      NOT NULL DEFAULT now(),
+  PRIMARY KEY (tx_id, timestamp)
+) PARTITION BY RANGE (timestamp);
 
--- 6. Authentication log table
+-- 6. Authentication log table (partitioned by month on auth_time)
 CREATE TABLE IF NOT EXISTS auth_log (
-  auth_id      UUID             PRIMARY KEY DEFAULT gen_random_uuid(),
-  tx_id        UUID             NOT NULL REFERENCES transaction(tx_id),
+  auth_id      UUID             NOT NULL DEFAULT gen_random_uuid(),
+  tx_id        UUID             NOT NULL,      -- transaction(tx_id)
   auth_type    VARCHAR(20)      NOT NULL,      -- 'PIN', 'otp', 'biometric'
   success_flag BOOLEAN          ,
-  auth_time    TIMESTAMPTZ      NOT NULL DEFAULT now()
-);
+  auth_time    TIMESTAMPTZ      NOT NULL DEFAULT now(),
+  PRIMARY KEY (auth_id, auth_time)
+) PARTITION BY RANGE (auth_time);
 
--- 7. Fraud risk tagging table
+-- 7. Fraud risk tagging table (partitioned by month on flagged_at)
 CREATE TABLE IF NOT EXISTS risk_tag (
-  risk_id     UUID             PRIMARY KEY DEFAULT gen_random_uuid(),
-  tx_id       UUID             NOT NULL REFERENCES transaction(tx_id),
+  risk_id     UUID             NOT NULL DEFAULT gen_random_uuid(),
+  tx_id       UUID             NOT NULL,       -- transaction(tx_id)
   tag_reason  TEXT             NOT NULL,
   severity    SMALLINT         NOT NULL,       -- e.g., 1 (low) to 5 (high)
-  flagged_at  TIMESTAMPTZ      NOT NULL DEFAULT now()
-);
+  flagged_at  TIMESTAMPTZ      NOT NULL DEFAULT now(),
+  PRIMARY KEY (risk_id, flagged_at)
+) PARTITION BY RANGE (flagged_at);
+
+-- catch-all partitions for rows outside the pre-created ranges
+CREATE TABLE IF NOT EXISTS transaction_default PARTITION OF transaction DEFAULT;
+CREATE TABLE IF NOT EXISTS auth_log_default    PARTITION OF auth_log    DEFAULT;
+CREATE TABLE IF NOT EXISTS risk_tag_default    PARTITION OF risk_tag    DEFAULT;
+
+-- Create the daily transaction and monthly auth_log/risk_tag partitions from
+-- yesterday up to p_days_ahead days ahead. Called by the generator and processor.
+CREATE OR REPLACE FUNCTION ensure_partitions(p_days_ahead INT DEFAULT 7) RETURNS void AS $$
+DECLARE
+  d DATE;
+  m DATE;
+  t TEXT;
+BEGIN
+  PERFORM pg_advisory_xact_lock(hashtext('banking.ensure_partitions'));
+  FOR d IN SELECT generate_series(current_date - 1, current_date + p_days_ahead, interval '1 day')::date LOOP
+    EXECUTE format('CREATE TABLE IF NOT EXISTS banking.%I PARTITION OF banking.transaction FOR VALUES FROM (%L) TO (%L)',
+                   'transaction_' || to_char(d, 'YYYYMMDD'), d, d + 1);
+  END LOOP;
+  FOR m IN SELECT generate_series(date_trunc('month', current_date - 1),
+                                  date_trunc('month', current_date + p_days_ahead), interval '1 month')::date LOOP
+    FOREACH t IN ARRAY ARRAY['auth_log', 'risk_tag'] LOOP
+      EXECUTE format('CREATE TABLE IF NOT EXISTS banking.%I PARTITION OF banking.%I FOR VALUES FROM (%L) TO (%L)',
+                     t || '_' || to_char(m, 'YYYYMM'), t, m, (m + interval '1 month')::date);
+    END LOOP;
+  END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Detach partitions that ended more than p_retain ago and move them to the
+-- banking_archive schema. Returns the archived partition names.
+-- A day of transactions is kept until the monthly auth_log/risk_tag partitions
+-- that can reference it are archived too, so the audit rows never outlive their
+-- transactions: its audit rows are written when it is settled, which can be the
+-- next day (the next month for a month's last day).
+CREATE OR REPLACE FUNCTION archive_partitions(p_retain INTERVAL DEFAULT '90 days')
+RETURNS SETOF TEXT AS $$
+DECLARE
+  p RECORD;
+BEGIN
+  PERFORM pg_advisory_xact_lock(hashtext('banking.ensure_partitions'));
+  FOR p IN
+    SELECT parent.relname AS parent, child.relname AS child,
+           CASE WHEN parent.relname = 'transaction'
+                THEN (date_trunc('month', to_date(right(child.relname, 8), 'YYYYMMDD') + 1)
+                      + interval '1 month')::date
+                ELSE (to_date(right(child.relname, 6), 'YYYYMM') + interval '1 month')::date
+           END AS upper_bound
+    FROM pg_inherits i
+    JOIN pg_class parent ON parent.oid = i.inhparent
+    JOIN pg_class child  ON child.oid  = i.inhrelid
+    JOIN pg_namespace n  ON n.oid = parent.relnamespace
+    WHERE n.nspname = 'banking'
+      AND ((parent.relname = 'transaction' AND child.relname ~ '^transaction_[0-9]{8}$')
+        OR (parent.relname IN ('auth_log', 'risk_tag') AND child.relname ~ '_[0-9]{6}$'))
+  LOOP
+    IF p.upper_bound <= now() - p_retain THEN
+      EXECUTE format('ALTER TABLE banking.%I DETACH PARTITION banking.%I', p.parent, p.child);
+      EXECUTE format('ALTER TABLE banking.%I SET SCHEMA banking_archive', p.child);
+      RETURN NEXT p.child;
+    END IF;
+  END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_partitions();
 
 -- 8. Indexes & Performance Hints
 CREATE INDEX IF NOT EXISTS idx_account_customer  ON account(customer_id);
-CREATE INDEX IF NOT EXISTS idx_tx_account        ON transaction(account_id);
+CREATE INDEX IF NOT EXISTS idx_tx_account_time   ON transaction(account_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_tx_pending        ON transaction(timestamp, tx_id) WHERE status = 'pending';
+-- pending transfers per source/target account (set-based settlement ordering checks)
+CREATE INDEX IF NOT EXISTS idx_tx_pending_transfer_src ON transaction(account_id, timestamp, tx_id)
+  WHERE status = 'pending' AND target_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_tx_pending_transfer_dst ON transaction(target_id, timestamp, tx_id)
+  WHERE status = 'pending' AND target_id IS NOT NULL;
 CREATE INDEX IF NOT EXISTS idx_auth_tx           ON auth_log(tx_id);
 CREATE INDEX IF NOT EXISTS idx_device_cust       ON device(customer_id);
 CREATE INDEX IF NOT EXISTS idx_risk_tx           ON risk_tag(tx_id);
+
+-- insertion-time indexes for incremental data quality checks
+CREATE INDEX IF NOT EXISTS idx_customer_created  ON customer(created_at);
+CREATE INDEX IF NOT EXISTS idx_account_opened    ON account(opened_at);
+CREATE INDEX IF NOT EXISTS idx_device_first_seen ON device(first_seen);
+CREATE INDEX IF NOT EXISTS idx_tx_timestamp      ON transaction(timestamp);
+CREATE INDEX IF NOT EXISTS idx_auth_time         ON auth_log(auth_time);
+CREATE INDEX IF NOT EXISTS idx_risk_flagged      ON risk_tag(flagged_at);
+
+-- 9. Change notifications
+-- Processors cache device trust and LISTEN here to drop a customer's cached devices.
+CREATE OR REPLACE FUNCTION notify_device_change() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    PERFORM pg_notify('banking_device', OLD.customer_id::text);
+  ELSE
+    PERFORM pg_notify('banking_device', NEW.customer_id::text);
+  END IF;
+  IF TG_OP = 'UPDATE' AND OLD.customer_id <> NEW.customer_id THEN
+    PERFORM pg_notify('banking_device', OLD.customer_id::text);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_device_notify ON device;
+CREATE TRIGGER trg_device_notify
+  AFTER INSERT OR UPDATE OR DELETE ON device
+  FOR EACH ROW EXECUTE FUNCTION notify_device_change();
+
+-- 10. Watermarks of incremental jobs (e.g. job 'data_quality')
+CREATE TABLE IF NOT EXISTS watermark (
+  job           TEXT             NOT NULL,
+  table_name    TEXT             NOT NULL,
+  high_water    TIMESTAMPTZ      NOT NULL,     -- rows up to here have been handled
+  last_full_run TIMESTAMPTZ,
+  updated_at    TIMESTAMPTZ      NOT NULL DEFAULT now(),
+  PRIMARY KEY (job, table_name)
+);
+
+-- 11. Dashboard aggregates, maintained by the triggers below
+-- Counters are spread over buckets (backend pid % 16) so concurrent processors
+-- do not queue on the same row; readers SUM over buckets.
+CREATE TABLE IF NOT EXISTS risk_summary (
+  day          DATE             NOT NULL,      -- flagged_at day
+  tag_reason   TEXT             NOT NULL,
+  severity     SMALLINT         NOT NULL,
+  bucket       SMALLINT         NOT NULL,
+  total        BIGINT           NOT NULL DEFAULT 0,
+  PRIMARY KEY (day, tag_reason, severity, bucket)
+);
+
+CREATE TABLE IF NOT EXISTS failure_summary (
+  day          DATE             NOT NULL,      -- transaction day
+  customer_id  UUID             NOT NULL,
+  fail_type    TEXT             NOT NULL,      -- auth_type of a failed transaction, or 'UNTRUSTED DEVICES'
+  bucket       SMALLINT         NOT NULL,
+  total        BIGINT           NOT NULL DEFAULT 0,
+  PRIMARY KEY (day, customer_id, fail_type, bucket)
+);
+
+CREATE OR REPLACE FUNCTION bump_failure_summary(p_tx_id UUID, p_fail_type TEXT, p_delta BIGINT)
+RETURNS void AS $$
+BEGIN
+  INSERT INTO banking.failure_summary (day, customer_id, fail_type, bucket, total)
+  SELECT tx.timestamp::date, acc.customer_id, p_fail_type, pg_backend_pid() % 16, p_delta
+  FROM banking.transaction tx
+  JOIN banking.account acc ON acc.account_id = tx.account_id
+  WHERE tx.tx_id = p_tx_id
+  ON CONFLICT (day, customer_id, fail_type, bucket)
+  DO UPDATE SET total = failure_summary.total + EXCLUDED.total;
+END;
+$$ LANGUAGE plpgsql;
+
+-- every risk tag; severity 4 (untrusted device) also counts as a customer failure
+CREATE OR REPLACE FUNCTION summarize_risk_tag() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO banking.risk_summary (day, tag_reason, severity, bucket, total)
+  VALUES (NEW.flagged_at::date, NEW.tag_reason, NEW.severity, pg_backend_pid() % 16, 1)
+  ON CONFLICT (day, tag_reason, severity, bucket)
+  DO UPDATE SET total = risk_summary.total + 1;
+  IF NEW.severity = 4 THEN
+    PERFORM banking.bump_failure_summary(NEW.tx_id, 'UNTRUSTED DEVICES', 1);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- an auth attempt on a transaction that has already failed
+CREATE OR REPLACE FUNCTION summarize_auth_log() RETURNS trigger AS $$
+BEGIN
+  IF EXISTS (SELECT 1 FROM banking.transaction WHERE tx_id = NEW.tx_id AND status = 'failed') THEN
+    PERFORM banking.bump_failure_summary(NEW.tx_id, NEW.auth_type, 1);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- a transaction entering (or leaving) 'failed' counts its existing auth attempts
+CREATE OR REPLACE FUNCTION summarize_tx_status() RETURNS trigger AS $$
+DECLARE
+  delta BIGINT := CASE WHEN NEW.status = 'failed' THEN 1 ELSE -1 END;
+  a RECORD;
+BEGIN
+  FOR a IN SELECT auth_type, count(*) AS n FROM banking.auth_log WHERE tx_id = NEW.tx_id GROUP BY auth_type LOOP
+    PERFORM banking.bump_failure_summary(NEW.tx_id, a.auth_type, delta * a.n);
+  END LOOP;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_risk_summary ON risk_tag;
+CREATE TRIGGER trg_risk_summary
+  AFTER INSERT ON risk_tag
+  FOR EACH ROW EXECUTE FUNCTION summarize_risk_tag();
+
+DROP TRIGGER IF EXISTS trg_auth_summary ON auth_log;
+CREATE TRIGGER trg_auth_summary
+  AFTER INSERT ON auth_log
+  FOR EACH ROW EXECUTE FUNCTION summarize_auth_log();
+
+DROP TRIGGER IF EXISTS trg_tx_status_summary ON transaction;
+CREATE TRIGGER trg_tx_status_summary
+  AFTER UPDATE OF status ON transaction
+  FOR EACH ROW
+  WHEN ((OLD.status = 'failed') IS DISTINCT FROM (NEW.status = 'failed'))
+  EXECUTE FUNCTION summarize_tx_status();
+
+-- Recompute both aggregates from the base tables (backfill for existing data).
+CREATE OR REPLACE FUNCTION rebuild_dashboard_summaries() RETURNS void AS $$
+BEGIN
+  TRUNCATE banking.risk_summary, banking.failure_summary;
+  INSERT INTO banking.risk_summary (day, tag_reason, severity, bucket, total)
+  SELECT flagged_at::date, tag_reason, severity, 0, count(*)
+  FROM banking.risk_tag
+  GROUP BY 1, 2, 3;
+  INSERT INTO banking.failure_summary (day, customer_id, fail_type, bucket, total)
+  SELECT tx.timestamp::date, acc.customer_id, auth.auth_type, 0, count(*)
+  FROM banking.transaction tx
+  JOIN banking.account acc ON tx.account_id = acc.account_id
+  JOIN banking.auth_log auth ON tx.tx_id = auth.tx_id
+  WHERE tx.status = 'failed'
+  GROUP BY 1, 2, 3
+  UNION ALL
+  SELECT tx.timestamp::date, acc.customer_id, 'UNTRUSTED DEVICES', 0, count(*)
+  FROM banking.risk_tag rt
+  JOIN banking.transaction tx ON rt.tx_id = tx.tx_id
+  JOIN banking.account acc ON tx.account_id = acc.account_id
+  WHERE rt.severity = 4
+  GROUP BY 1, 2;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 12. Pending queue notifications
+-- One NOTIFY per INSERT/COPY statement wakes streaming processors
+-- (monitoring_audit.py --stream) without a row-level trigger cost.
+CREATE OR REPLACE FUNCTION notify_tx_pending() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify('banking_tx_pending', '');
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_tx_pending_notify ON transaction;
+CREATE TRIGGER trg_tx_pending_notify
+  AFTER INSERT ON transaction
+  FOR EACH STATEMENT EXECUTE FUNCTION notify_tx_pending();
+
+-- 13. Running amount statistics per account for batch risk scoring
+-- (src/risk_scoring.py); merged after every scored window, Welford style.
+CREATE TABLE IF NOT EXISTS account_amount_stats (
+  account_id   UUID              PRIMARY KEY,
+  n            BIGINT            NOT NULL,
+  mean         DOUBLE PRECISION  NOT NULL,     -- of abs(amount)
+  m2           DOUBLE PRECISION  NOT NULL,     -- sum of squared deviations
+  updated_at   TIMESTAMPTZ       NOT NULL DEFAULT now()
+);
+
+-- 14. Checkpointed processing (monitoring_audit.py --checkpointed)
+-- Every transaction carries an idempotency key. tx_state records how far a
+-- transaction has been processed (claimed -> debited -> authenticated -> settled,
+-- or failed), balance_ledger records each balance change once per (key, step) so
+-- a resumed run never applies it twice, and process_checkpoint holds the batch
+-- and phase each worker last committed.
+ALTER TABLE transaction ADD COLUMN IF NOT EXISTS idempotency_key UUID NOT NULL DEFAULT gen_random_uuid();
+
+CREATE TABLE IF NOT EXISTS tx_state (
+  idempotency_key UUID             PRIMARY KEY,
+  tx_id           UUID             NOT NULL,
+  tx_time         TIMESTAMPTZ      NOT NULL,
+  state           TEXT             NOT NULL
+                  CHECK (state IN ('claimed', 'debited', 'authenticated', 'settled', 'failed')),
+  worker          TEXT             NOT NULL,
+  batch_id        UUID             NOT NULL,
+  updated_at      TIMESTAMPTZ      NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS balance_ledger (
+  idempotency_key UUID             NOT NULL,
+  step            TEXT             NOT NULL,     -- 'debit', 'refund', 'credit' or 'apply'
+  account_id      UUID             NOT NULL,
+  amount          NUMERIC(18,2)    NOT NULL,
+  applied_at      TIMESTAMPTZ      NOT NULL DEFAULT now(),
+  PRIMARY KEY (idempotency_key, step)
+);
+
+CREATE TABLE IF NOT EXISTS process_checkpoint (
+  worker          TEXT             PRIMARY KEY,  -- 'shard-<n>-of-<total>'
+  batch_id        UUID             NOT NULL,
+  phase           TEXT             NOT NULL,     -- state the whole batch has reached
+  last_timestamp  TIMESTAMPTZ,
+  last_tx_id      UUID,
+  processed       BIGINT           NOT NULL DEFAULT 0,
+  failed          BIGINT           NOT NULL DEFAULT 0,
+  updated_at      TIMESTAMPTZ      NOT NULL DEFAULT now()
+);
@@ -0,0 +1,127 @@
+-- Server-side settlement of pending transactions (optional processor mode, see
+-- monitoring_audit.py --procedure). Applies the same rules as
+-- process_transaction: device trust, balance check, high-value and cumulative
+-- daily authentication tiering, auth_log and risk_tag writes.
+--
+-- Authentication is simulated by the caller, which passes one outcome and one
+-- strong method ('Biometric'/'OTP', used for high-value transfers) per tx_id, so
+-- both paths agree on the same seeded data. Transactions are settled in the
+-- order given; rows that are no longer pending or are locked elsewhere are
+-- skipped, and a database error only rolls back that transaction (it stays pending).
+-- Installed after schema.sql.
+
+CREATE OR REPLACE FUNCTION banking.settle_transactions(
+  p_tx_ids         UUID[],
+  p_auth_ok        BOOLEAN[],
+  p_strong_methods TEXT[]
+) RETURNS TABLE (tx_id UUID, status TEXT, reason TEXT) AS $$
+#variable_conflict use_column
+DECLARE
+  c_high_value  CONSTANT NUMERIC := 10000000;     -- HIGH_VALUE_THRESHOLD
+  c_cumulative  CONSTANT NUMERIC := 20000000;     -- CUMULATIVE_THRESHOLD
+  v_day_start   TIMESTAMPTZ := date_trunc('day', now());
+  v_day_end     TIMESTAMPTZ := date_trunc('day', now()) + interval '1 day';
+  i             INT;
+  tx            RECORD;
+  v_customer    UUID;
+  v_balance     NUMERIC;
+  v_spent       NUMERIC;
+  v_severity    SMALLINT;
+  v_auth_type   TEXT;
+BEGIN
+  FOR i IN 1 .. coalesce(array_length(p_tx_ids, 1), 0) LOOP
+    SELECT t.tx_id, t.account_id, t.device_id, t.target_id, t.amount, t.timestamp
+    INTO tx
+    FROM banking.transaction t
+    WHERE t.tx_id = p_tx_ids[i] AND t.status = 'pending'
+    FOR UPDATE SKIP LOCKED;
+    CONTINUE WHEN NOT FOUND;
+
+    tx_id := tx.tx_id;
+    BEGIN
+      SELECT a.customer_id INTO v_customer FROM banking.account a WHERE a.account_id = tx.account_id;
+
+      IF tx.target_id IS NOT NULL THEN                      -- Transfer
+        IF NOT EXISTS (SELECT 1 FROM banking.device d
+                       WHERE d.device_id = tx.device_id AND d.customer_id = v_customer AND d.active) THEN
+          UPDATE banking.transaction t SET status = 'failed'
+          WHERE t.tx_id = tx.tx_id AND t.timestamp = tx.timestamp;
+          INSERT INTO banking.risk_tag (tx_id, severity, tag_reason)
+          VALUES (tx.tx_id, 4, 'Untrusted device');
+          status := 'failed'; reason := 'Untrusted device';
+          RETURN NEXT;
+          CONTINUE;
+        END IF;
+
+        SELECT a.balance INTO v_balance FROM banking.account a
+        WHERE a.account_id = tx.account_id FOR UPDATE;
+        IF v_balance - tx.amount < 0 THEN
+          UPDATE banking.transaction t SET status = 'failed'
+          WHERE t.tx_id = tx.tx_id AND t.timestamp = tx.timestamp;
+          status := 'failed'; reason := 'Insufficient balance';
+          RETURN NEXT;
+          CONTINUE;
+        END IF;
+
+        -- authentication tier, as in define_high_value_transaction
+        v_severity := 1; v_auth_type := 'PIN';
+        IF tx.amount > c_high_value THEN
+          v_severity := 2; v_auth_type := p_strong_methods[i];
+        ELSIF tx.timestamp >= v_day_start AND tx.timestamp < v_day_end THEN
+          SELECT coalesce(sum(abs(t.amount)), 0) INTO v_spent
+          FROM banking.transaction t
+          JOIN banking.account a ON a.account_id = t.account_id
+          WHERE a.customer_id = v_customer AND t.status = 'success'
+            AND t.timestamp >= v_day_start AND t.timestamp < v_day_end;
+          IF v_spent + tx.amount > c_cumulative THEN
+            v_severity := 3;
+            v_auth_type := CASE WHEN floor((v_spent + tx.amount) / c_high_value) > floor(v_spent / c_high_value)
+                                THEN 'Biometric' ELSE 'OTP' END;
+          END IF;
+        END IF;
+
+        INSERT INTO banking.auth_log (tx_id, auth_type, success_flag)
+        VALUES (tx.tx_id, v_auth_type, p_auth_ok[i]);
+
+        IF NOT p_auth_ok[i] THEN
+          UPDATE banking.transaction t SET status = 'failed'
+          WHERE t.tx_id = tx.tx_id AND t.timestamp = tx.timestamp;
+          IF v_severity = 2 THEN
+            INSERT INTO banking.risk_tag (tx_id, severity, tag_reason)
+            VALUES (tx.tx_id, v_severity, 'High value transaction');
+          ELSIF v_severity = 3 THEN
+            INSERT INTO banking.risk_tag (tx_id, severity, tag_reason)
+            VALUES (tx.tx_id, v_severity, 'Cumulative amount exceeds 20,000,000 VND');
+          END IF;
+          status := 'failed'; reason := 'Authentication failed';
+          RETURN NEXT;
+          CONTINUE;
+        END IF;
+
+        UPDATE banking.account a SET balance = a.balance - tx.amount WHERE a.account_id = tx.account_id;
+        UPDATE banking.account a SET balance = a.balance + tx.amount
+        WHERE a.account_id = tx.target_id AND a.balance + tx.amount >= 0;
+
+      ELSE                                                  -- Deposit / withdrawal
+        UPDATE banking.account a SET balance = a.balance + tx.amount
+        WHERE a.account_id = tx.account_id AND a.balance + tx.amount >= 0;
+        IF NOT FOUND THEN
+          UPDATE banking.transaction t SET status = 'failed'
+          WHERE t.tx_id = tx.tx_id AND t.timestamp = tx.timestamp;
+          status := 'failed'; reason := 'Insufficient balance';
+          RETURN NEXT;
+          CONTINUE;
+        END IF;
+      END IF;
+
+      UPDATE banking.transaction t SET status = 'success'
+      WHERE t.tx_id = tx.tx_id AND t.timestamp = tx.timestamp;
+      status := 'success'; reason := NULL;
+      RETURN NEXT;
+    EXCEPTION WHEN OTHERS THEN
+      status := 'error'; reason := SQLERRM;
+      RETURN NEXT;
+    END;
+  END LOOP;
+END;
+$$ LANGUAGE plpgsql;
@@ -2,125 +2,271 @@
 data_quality_standards.py
 
 Performs schema‐level and value‐level data quality checks on the banking schema.
+
+Rules are declared per table in CHECKS and compiled into a single aggregate
+query per table, so each table is scanned once. Tables are checked
+concurrently, each on its own pooled connection.
+
+In incremental mode only rows newer than the table's watermark (stored in
+banking.watermark) are validated, with a full scan every FULL_SCAN_DAYS.
 """
 
 import os
-import re
 import sys
 import logging
-import psycopg2
-
-DB_HOST     = os.getenv("POSTGRES_HOST", "db")
-DB_PORT     = os.getenv("POSTGRES_PORT", 5432)
-DB_NAME     = os.getenv("POSTGRES_DB", "banking")
-DB_USER     = os.getenv("POSTGRES_USER", "postgres")
-DB_PASSWORD = os.getenv("POSTGRES_PASSWORD", "secret")
+from datetime import date
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2 import sql
+import metrics
+from db import pooled_connection
+from watermarks import ensure_watermarks, read_watermark, save_watermark
 
 HIGH_VALUE_THRESHOLD = 10_000_000  # VND
 
+SCHEMA      = "banking"
+DQ_WORKERS  = int(os.getenv("DQ_WORKERS", 4))
+SAMPLE_SIZE = 5
+STREAM_CHUNK = int(os.getenv("DQ_STREAM_CHUNK", 10_000))   # rows per fetch for Python rules
+
+WATERMARK_JOB  = "data_quality"
+FULL_SCAN_DAYS = int(os.getenv("DQ_FULL_SCAN_DAYS", 7))
+# rows are only validated once they are older than this, so transactions still
+# in flight when the watermark is taken are not skipped
+WATERMARK_LAG  = os.getenv("DQ_WATERMARK_LAG", "5 minutes")
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s %(levelname)s %(message)s",
     handlers=[logging.StreamHandler()]
 )
 
-def connect_db():
-    return psycopg2.connect(
-        host=DB_HOST or None,
-        port=DB_PORT,
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD
-    )
-
-# Null / Missing Checks
-def check_not_null(table, column):
-    sql = f"""
-      SELECT COUNT(*) 
-      FROM {table} 
-      WHERE {column} IS NULL;
-    """
-    with conn.cursor() as cur:
-        cur.execute(sql)
-        cnt = cur.fetchone()[0]
-        if cnt:
-            logging.error(f"{cnt} NULL(s) found in {table}.{column}")
+CCCD_PATTERN    = r"^\d{12}$"                  # CCCD = 12 digits
+CONTACT_PATTERN = r"^(\+?[0-9 ().-]{9,20}|[^@\s]+@[^@\s]+\.[^@\s]+)$"   # phone or email
+
+# customers must be adults
+def is_adult(birth_date):
+    today = date.today()
+    return birth_date is not None and (today.year - birth_date.year
+                                       - ((today.month, today.day) < (birth_date.month, birth_date.day))) >= 18
+
+# Rules per table: NOT NULL columns, unique columns and foreign keys as
+# (column, parent table, parent column). "key" identifies rows in samples,
+# "time" is the insertion time column used for the incremental watermark.
+# "pattern" rules are (column, regex) and run inside PostgreSQL; "predicate"
+# rules are (column, python function) for checks that cannot be pushed down
+# and are evaluated over a server-side cursor, STREAM_CHUNK rows at a time.
+CHECKS = {
+    "customer": {
+        "key":      "customer_id",
+        "time":     "created_at",
+        "not_null": ["customer_id", "id_number"],
+        "unique":   ["contact", "customer_id"],     # phone/email unique
+        "pattern":  [("id_number", CCCD_PATTERN), ("contact", CONTACT_PATTERN)],
+        "predicate": [("birth_date", is_adult)],
+    },
+    "account": {
+        "key":      "account_id",
+        "time":     "opened_at",
+        "not_null": ["account_id"],
+        "unique":   ["account_id"],
+        "fk":       [("customer_id", "customer", "customer_id")],
+    },
+    "transaction": {
+        "key":      "tx_id",
+        "time":     "timestamp",
+        "not_null": ["tx_id"],
+        "unique":   ["tx_id"],
+        "fk":       [("account_id", "account", "account_id")],
+    },
+    "auth_log": {
+        "key":      "auth_id",
+        "time":     "auth_time",
+        "not_null": ["auth_id"],
+        "fk":       [("tx_id", "transaction", "tx_id")],
+    },
+    "device": {
+        "key":      "device_id",
+        "time":     "first_seen",
+        "fk":       [("customer_id", "customer", "customer_id")],
+    },
+    "risk_tag": {
+        "key":      "risk_id",
+        "time":     "flagged_at",
+        "fk":       [("tx_id", "transaction", "tx_id")],
+    },
+}
+
+# Outcome of one rule; samples holds up to SAMPLE_SIZE offending rows.
+CheckResult = namedtuple("CheckResult", "table rule column passed count samples")
+
+def _table(name):
+    return sql.Identifier(SCHEMA, name)
+
+# WHERE clause restricting a table to rows inserted in (since, until]; empty for a full scan.
+def window_clause(rules, incremental):
+    if not incremental:
+        return sql.SQL("")
+    return sql.SQL("WHERE c.{0} > %(since)s AND c.{0} <= %(until)s").format(sql.Identifier(rules["time"]))
+
+# Another row of the table holds the same value; uses the column's index.
+def _duplicate_exists(table, column):
+    return sql.SQL("EXISTS (SELECT 1 FROM {0} o WHERE o.{1} = c.{1} "
+                   "AND (o.tableoid, o.ctid) <> (c.tableoid, c.ctid))").format(
+        _table(table), sql.Identifier(column))
+
+# Value does not match the regex; NULL counts as a mismatch.
+def _pattern_mismatch(column, pattern):
+    return sql.SQL("COALESCE(c.{} !~ {}, TRUE)").format(sql.Identifier(column), sql.Literal(pattern))
+
+# Build the single aggregate query for a table.
+# Returns the query and the (rule, column) each output column answers.
+# Incrementally, uniqueness is checked for the new rows against the whole table.
+def compile_table_query(table, rules, incremental=False):
+    exprs, labels, joins = [], [], []
+    for column in rules.get("not_null", []):
+        exprs.append(sql.SQL("COUNT(*) FILTER (WHERE c.{} IS NULL)").format(sql.Identifier(column)))
+        labels.append(("not_null", column))
+    for column in rules.get("unique", []):
+        if incremental:
+            exprs.append(sql.SQL("COUNT(*) FILTER (WHERE {})").format(_duplicate_exists(table, column)))
         else:
-            logging.info(f"OK: no NULLs in {table}.{column}")
-
-# Uniqueness Checks
-def check_unique(table, column):
-    sql = f"""
-      SELECT {column}, COUNT(*) 
-      FROM {table} 
-      GROUP BY {column}
-      HAVING COUNT(*) > 1;
-    """
-    cur.execute(sql)
-    if cur.rowcount > 0:
-        logging.error(f"Duplicates in {table}.{column}: {rows[:5]}{'…' if len(rows)>5 else ''}")
-    else:
-        logging.info(f"OK: all values unique in {table}.{column}")
-
-# Format / Length Checks (CCCD = 12 digits)
-def check_cccd_format():
-    sql = f"""
-      SELECT customer_id, id_number
-      FROM customer;
-    """
-    bad = []
-    pattern = re.compile(r"^\d{12}$")
-    cur.execute(sql)
-    for cust_id, id_number in cur.fetchall():
-        if not pattern.match(id_number or ""):
-            bad.append((cust_id, id_number))
-    if bad:
-        logging.error(f"Found {len(bad)} invalid CCCDs: {bad[:3]}{'…' if len(bad)>3 else ''}")
-    else:
-        logging.info("OK: all CCCDs match \\d{12}")
-
-# Foreign Key Integrity
-def check_fk(child_table, child_col, parent_table, parent_col):
-    sql = f"""
-      SELECT COUNT(*) 
-      FROM {child_table} c
-      LEFT JOIN {parent_table} p
-        ON c.{child_col} = p.{parent_col}
-      WHERE p.{parent_col} IS NULL;
-    """
-    cur.execute(sql)
-    if cur.rowcount == 0:
-        logging.error(f"{cnt} orphan rows in {child_table}.{child_col} → no match in {parent_table}.{parent_col}")
+            exprs.append(sql.SQL("COUNT(c.{0}) - COUNT(DISTINCT c.{0})").format(sql.Identifier(column)))
+        labels.append(("unique", column))
+    for column, pattern in rules.get("pattern", []):
+        exprs.append(sql.SQL("COUNT(*) FILTER (WHERE {})").format(_pattern_mismatch(column, pattern)))
+        labels.append(("pattern", column))
+    for i, (column, parent, parent_col) in enumerate(rules.get("fk", [])):
+        alias = sql.Identifier(f"p{i}")
+        joins.append(sql.SQL("LEFT JOIN {} {} ON {}.{} = c.{}").format(
+            _table(parent), alias, alias, sql.Identifier(parent_col), sql.Identifier(column)))
+        exprs.append(sql.SQL("COUNT(*) FILTER (WHERE {}.{} IS NULL)").format(
+            alias, sql.Identifier(parent_col)))
+        labels.append(("fk", column))
+    query = sql.SQL("SELECT {} FROM {} c {} {}").format(
+        sql.SQL(", ").join(exprs), _table(table), sql.SQL(" ").join(joins),
+        window_clause(rules, incremental))
+    return query, labels
+
+# Bounded sample of rows breaking a rule, fetched only for failed rules.
+def sample_query(table, rules, rule, column, incremental=False):
+    key, col = sql.Identifier(rules["key"]), sql.Identifier(column)
+    window = window_clause(rules, incremental)
+    where = sql.SQL("AND") if incremental else sql.SQL("WHERE")
+    limit = sql.Literal(SAMPLE_SIZE)
+    if rule == "not_null":
+        return sql.SQL("SELECT c.{} FROM {} c {} {} c.{} IS NULL LIMIT {}").format(
+            key, _table(table), window, where, col, limit)
+    if rule == "pattern":
+        pattern = next(p for c, p in rules["pattern"] if c == column)
+        return sql.SQL("SELECT c.{}, c.{} FROM {} c {} {} {} LIMIT {}").format(
+            key, col, _table(table), window, where, _pattern_mismatch(column, pattern), limit)
+    if rule == "unique" and incremental:
+        return sql.SQL("SELECT c.{}, c.{} FROM {} c {} AND {} LIMIT {}").format(
+            key, col, _table(table), window, _duplicate_exists(table, column), limit)
+    if rule == "unique":
+        return sql.SQL("SELECT c.{0}, COUNT(*) FROM {1} c GROUP BY c.{0} HAVING COUNT(*) > 1 LIMIT {2}").format(
+            col, _table(table), limit)
+    parent, parent_col = next((p, pc) for c, p, pc in rules["fk"] if c == column)
+    return sql.SQL("SELECT c.{0}, c.{1} FROM {2} c LEFT JOIN {3} p ON p.{4} = c.{1} "
+                   "{5} {6} p.{4} IS NULL LIMIT {7}").format(
+        key, col, _table(table), _table(parent), sql.Identifier(parent_col), window, where, limit)
+
+# Evaluate a Python predicate over a named (server-side) cursor so only
+# STREAM_CHUNK rows are held in memory whatever the table size.
+def check_predicate(conn, table, rules, column, predicate, incremental=False, params=None):
+    count, samples = 0, []
+    with conn.cursor(name=f"dq_{table}_{column}") as cur:
+        cur.itersize = STREAM_CHUNK
+        cur.execute(sql.SQL("SELECT c.{}, c.{} FROM {} c {}").format(
+            sql.Identifier(rules["key"]), sql.Identifier(column), _table(table),
+            window_clause(rules, incremental)), params)
+        for key, value in cur:
+            if not predicate(value):
+                count += 1
+                if len(samples) < SAMPLE_SIZE:
+                    samples.append((key, value))
+    return CheckResult(table, "predicate", column, count == 0, count, samples)
+
+# Run every rule of one table on its own pooled connection.
+# Incrementally, only rows since the last run are checked unless a periodic full
+# scan is due; the watermark advances once the table's checks have run.
+def run_table_checks(table, rules=None, incremental=False, full_scan_days=FULL_SCAN_DAYS):
+    rules = rules or CHECKS[table]
+    with metrics.timer("dq_table_check", table=table), pooled_connection() as conn:
+        results = []
+        with conn.cursor() as cur:
+            since, last_full = read_watermark(cur, WATERMARK_JOB, table)
+            cur.execute("SELECT now() - %s::interval, now() - make_interval(days => %s);",
+                        (WATERMARK_LAG, full_scan_days))
+            until, full_due = cur.fetchone()
+            full = not incremental or since is None or last_full is None or last_full < full_due
+            params = {"since": since, "until": until}
+            if incremental:
+                logging.info(f"{table}: {'full scan' if full else f'checking rows after {since}'}")
+
+            query, labels = compile_table_query(table, rules, not full)
+            with metrics.timer("dq_aggregate_query", table=table):
+                cur.execute(query, params)
+                counts = cur.fetchone()
+            for (rule, column), cnt in zip(labels, counts):
+                samples = []
+                if cnt:
+                    cur.execute(sample_query(table, rules, rule, column, not full), params)
+                    samples = cur.fetchall()
+                results.append(CheckResult(table, rule, column, cnt == 0, cnt, samples))
+            for column, predicate in rules.get("predicate", []):
+                with metrics.timer("dq_predicate_check", table=table, column=column):
+                    results.append(check_predicate(conn, table, rules, column, predicate, not full, params))
+            for r in results:
+                metrics.increment("dq_failed_rows", r.count, table=table, rule=r.rule, column=r.column)
+
+            save_watermark(cur, WATERMARK_JOB, table, until, full)
+        conn.commit()
+        return results
+
+def ensure_watermark_table():
+    with pooled_connection() as conn:
+        with conn, conn.cursor() as cur:
+            ensure_watermarks(cur)
+
+def log_result(r):
+    if r.passed:
+        logging.info(f"OK: {r.rule} check passed for {r.table}.{r.column}")
     else:
-        logging.info(f"OK: all {child_table}.{child_col} have valid parent in {parent_table}")
+        more = '…' if r.count > len(r.samples) else ''
+        logging.error(f"{r.count} row(s) failed {r.rule} check on {r.table}.{r.column}: {r.samples}{more}")
+
+# Check all tables concurrently and return a flat list of results.
+def run_checks(tables=None, workers=DQ_WORKERS, incremental=False, full_scan_days=FULL_SCAN_DAYS):
+    tables = tables or list(CHECKS)
+    ensure_watermark_table()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        per_table = list(pool.map(lambda t: run_table_checks(t, None, incremental, full_scan_days), tables))
+    results = [r for table_results in per_table for r in table_results]
+    for r in results:
+        log_result(r)
+    return results
+
+# Airflow task callable for one table (mapped over CHECKS by banking_dq_dag.py):
+# runs and logs its checks and returns a JSON-serializable summary for XCom.
+# The watermark table must exist already (ensure_watermark_table task).
+def check_table(table, incremental=True, full_scan_days=FULL_SCAN_DAYS, strict=False):
+    results = run_table_checks(table, None, incremental, full_scan_days)
+    for r in results:
+        log_result(r)
+    failed = [r for r in results if not r.passed]
+    if strict and failed:
+        raise ValueError(f"{len(failed)} data quality check(s) failed on {table}")
+    return [{"rule": r.rule, "column": r.column, "passed": r.passed, "count": r.count} for r in results]
 
 if __name__ == "__main__":
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("SET search_path TO banking;") 
-    try:
-        # 1. Not-null on critical columns
-        check_not_null("customer", "customer_id")
-        check_not_null("customer", "id_number")
-        check_not_null("account",  "account_id")
-        check_not_null("transaction", "tx_id")
-        check_not_null("auth_log", "auth_id")
-
-        # 2. Uniqueness
-        check_unique("customer", "contact")     # phone/email unique
-        check_unique("customer", "customer_id")
-        check_unique("account",  "account_id")
-        check_unique("transaction", "tx_id")
-
-        # 3. Format
-        check_cccd_format()
-
-        # 4. Foreign keys
-        check_fk("account", "customer_id",   "customer",    "customer_id")
-        check_fk("transaction", "account_id", "account",    "account_id")
-        check_fk("auth_log", "tx_id",         "transaction", "tx_id")
-        check_fk("device", "customer_id",     "customer",    "customer_id")
-        check_fk("risk_tag", "tx_id",         "transaction", "tx_id")
-
-    finally:
-        conn.close()
+    args = sys.argv[1:]
+    # --incremental checks new rows only; --full forces the periodic full scan now
+    results = run_checks(incremental="--incremental" in args,
+                         full_scan_days=0 if "--full" in args else FULL_SCAN_DAYS)
+    failed = [r for r in results if not r.passed]
+    logging.info(f"{len(results) - len(failed)}/{len(results)} data quality checks passed")
+    metrics.write_textfile(suffix="data_quality")
+    if "--strict" in sys.argv[1:] and failed:
+        sys.exit(1)
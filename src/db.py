@@ -0,0 +1,138 @@
+"""
+db.py
+
+Shared database layer for the banking scripts: connection settings, a
+thread-safe connection pool, server-side prepared statements for the hot
+queries and connection health checks.
+"""
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool
+
+DB_HOST     = os.getenv("POSTGRES_HOST", "db")
+DB_PORT     = os.getenv("POSTGRES_PORT", 5432)
+DB_NAME     = os.getenv("POSTGRES_DB", "banking")
+DB_USER     = os.getenv("POSTGRES_USER", "postgres")
+DB_PASSWORD = os.getenv("POSTGRES_PASSWORD", "secret")
+
+POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+POOL_MAX = int(os.getenv("DB_POOL_MAX", 8))
+# pooled connections idle for longer than this are checked before reuse
+HEALTH_CHECK_IDLE_SECONDS = float(os.getenv("DB_HEALTH_CHECK_IDLE_SECONDS", 30))
+
+# Hot statements, prepared once per connection: name -> (parameter types, statement)
+PREPARED = {
+    "update_balance": ("numeric, uuid", """
+        UPDATE banking.account
+        SET balance = balance + $1
+        WHERE account_id = $2 AND balance + $1 >= 0"""),
+    "update_status": ("text, uuid, timestamptz", """
+        UPDATE banking.transaction
+        SET status = $1
+        WHERE tx_id = $2 AND timestamp = $3"""),
+    "insert_risk": ("uuid, uuid, smallint, text", """
+        INSERT INTO banking.risk_tag (risk_id, tx_id, severity, tag_reason)
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT DO NOTHING"""),
+    "insert_auth_log": ("uuid, uuid, text, boolean", """
+        INSERT INTO banking.auth_log (auth_id, tx_id, auth_type, success_flag)
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT DO NOTHING"""),
+}
+
+# Connection that remembers which statements it has prepared and when it was last used.
+class BankingConnection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.last_used = time.monotonic()
+
+def connection_params():
+    return dict(
+        host=DB_HOST or None,
+        port=DB_PORT,
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        connection_factory=BankingConnection,
+    )
+
+# open a connection to the database
+def connect_db():
+    return psycopg2.connect(**connection_params())
+
+# Run a prepared statement, preparing it on this connection first if needed.
+# PREPARE is session-level, so it survives rollbacks of the surrounding transaction.
+def execute_prepared(cur, name, params):
+    prepared = getattr(cur.connection, "prepared", None)
+    if prepared is None:                # plain psycopg2 connection: nowhere to remember it
+        prepared = set()
+    if name not in prepared:
+        types, statement = PREPARED[name]
+        cur.execute(f"PREPARE {name} ({types}) AS {statement};")
+        prepared.add(name)
+        if hasattr(cur.connection, "prepared"):
+            cur.connection.prepared = prepared
+    placeholders = ", ".join(["%s"] * len(params))
+    cur.execute(f"EXECUTE {name} ({placeholders});", params)
+
+# True if the connection is open and answers a trivial query.
+def is_healthy(conn):
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1;")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_inherited = []     # parent's pools in a forked child: kept alive, never closed from here
+
+# Process-wide pool; a forked worker gets its own instead of sharing the parent's sockets.
+def get_pool():
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid != os.getpid():
+            # closing (or garbage collecting) these would terminate the parent's sessions
+            _inherited.append(_pool)
+            _pool = None
+        if _pool is None or _pool.closed:
+            _pool = ThreadedConnectionPool(POOL_MIN, POOL_MAX, **connection_params())
+            _pool_pid = os.getpid()
+        return _pool
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and not _pool.closed and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+
+# Borrow a pooled connection; it is health-checked if it sat idle, rolled back
+# if left in a transaction and returned to the pool afterwards.
+@contextmanager
+def pooled_connection():
+    pool = get_pool()
+    conn = pool.getconn()
+    idle = time.monotonic() - getattr(conn, "last_used", 0)
+    if idle > HEALTH_CHECK_IDLE_SECONDS and not is_healthy(conn):
+        logging.warning("Discarding broken pooled connection")
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        if hasattr(conn, "last_used"):
+            conn.last_used = time.monotonic()
+        pool.putconn(conn, close=bool(conn.closed))
@@ -0,0 +1,186 @@
+"""
+export_parquet.py
+
+Incremental columnar snapshots of the banking tables for analytics, so heavy
+scans (e.g. the dashboard's failure rankings) can run on Parquet files with
+DuckDB/Arrow instead of the OLTP database.
+
+Append-only tables (transaction, auth_log, risk_tag) are exported by time
+window: rows whose time column is in (watermark, now() - EXPORT_LAG] are
+streamed out with COPY and written as Parquet, partitioned by day:
+
+    <EXPORT_DIR>/<table>/date=YYYY-MM-DD/part-<window>-<n>.parquet
+
+The watermark (job 'export' in banking.watermark) only advances after the
+files are written; a rerun of a failed window overwrites the same file names.
+Transactions are exported once, so only settled ones are: the transaction window
+ends just before the oldest transaction still pending, and the watermark waits
+there until the processor has settled it. Mutable tables (account) are written
+as a full snapshot per day, replacing that day's snapshot.
+"""
+
+import os
+import time
+import logging
+import argparse
+import tempfile
+from datetime import timezone
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+from psycopg2 import sql
+import metrics
+from db import pooled_connection
+from watermarks import ensure_watermarks, read_watermark, save_watermark
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", "/opt/airflow/exports")
+EXPORT_LAG = os.getenv("EXPORT_LAG", "15 minutes")
+WATERMARK_JOB = "export"
+CSV_BLOCK_SIZE = int(os.getenv("EXPORT_BLOCK_SIZE", 8 << 20))     # bytes parsed per record batch
+SPOOL_DIR  = os.getenv("EXPORT_SPOOL_DIR")                          # temp CSV location (default: system temp)
+
+# table -> time column of append-only tables, or None for a daily full snapshot
+EXPORTS = {
+    "transaction": "timestamp",
+    "auth_log":    "auth_time",
+    "risk_tag":    "flagged_at",
+    "account":     None,
+}
+# tables whose rows are final once their status is no longer 'pending'
+HOLD_PENDING = {"transaction"}
+
+# PostgreSQL column types -> Arrow types for the CSV reader
+ARROW_TYPES = {
+    "uuid":                     pa.string(),
+    "text":                     pa.string(),
+    "character varying":        pa.string(),
+    "inet":                     pa.string(),
+    "numeric":                  pa.decimal128(18, 2),
+    "boolean":                  pa.bool_(),
+    "smallint":                 pa.int16(),
+    "integer":                  pa.int32(),
+    "bigint":                   pa.int64(),
+    "date":                     pa.date32(),
+    "timestamp with time zone": pa.timestamp("us", tz="UTC"),
+}
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s %(levelname)s %(message)s",
+    handlers=[logging.StreamHandler()]
+)
+
+# (column, Arrow type) pairs and the matching SELECT list; timestamps are
+# rendered as ISO 8601 in UTC so the CSV reader parses them exactly.
+def table_schema(cur, table):
+    cur.execute("""
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_schema = 'banking' AND table_name = %s
+        ORDER BY ordinal_position;
+    """, (table,))
+    columns, select = [], []
+    for name, data_type in cur.fetchall():
+        columns.append((name, ARROW_TYPES.get(data_type, pa.string())))
+        if data_type == "timestamp with time zone":
+            select.append(sql.SQL("""to_char({} AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS.US"Z"')""")
+                          .format(sql.Identifier(name)))
+        else:
+            select.append(sql.Identifier(name))
+    return columns, sql.SQL(", ").join(select)
+
+# COPY the query to a temporary CSV file and return a streaming Arrow reader
+# over it, so memory stays bounded by CSV_BLOCK_SIZE whatever the window size.
+def copy_to_reader(cur, query, columns, spool):
+    cur.copy_expert(sql.SQL("COPY ({}) TO STDOUT WITH (FORMAT csv)").format(query).as_string(cur), spool)
+    spool.flush()
+    spool.seek(0)
+    return pacsv.open_csv(
+        spool,
+        read_options=pacsv.ReadOptions(column_names=[name for name, _ in columns],
+                                       block_size=CSV_BLOCK_SIZE),
+        convert_options=pacsv.ConvertOptions(column_types=dict(columns),
+                                             true_values=["t"], false_values=["f"],
+                                             strings_can_be_null=True),
+    )
+
+def write_partitions(reader, table, basename, replace=False):
+    ds.write_dataset(
+        reader,
+        os.path.join(EXPORT_DIR, table),
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([("date", pa.date32())]), flavor="hive"),
+        basename_template=f"part-{basename}-{{i}}.parquet",
+        existing_data_behavior="delete_matching" if replace else "overwrite_or_ignore",
+    )
+
+# Export one table; returns the number of rows written.
+def export_table(table, lag=EXPORT_LAG):
+    time_col = EXPORTS[table]
+    with metrics.timer("export_table", table=table), pooled_connection() as conn, conn.cursor() as cur:
+        cur.execute("SET LOCAL TIME ZONE 'UTC';")       # partition dates are UTC days
+        columns, cols = table_schema(cur, table)
+        columns.append(("date", pa.date32()))
+        target = sql.Identifier("banking", table)
+
+        if time_col is None:
+            query = sql.SQL("SELECT {}, current_date FROM {}").format(cols, target)
+            cur.execute("SELECT current_date;")
+            basename, since, until = f"snapshot-{cur.fetchone()[0]:%Y%m%d}", None, None
+        else:
+            since, _ = read_watermark(cur, WATERMARK_JOB, table)
+            cur.execute("SELECT now() - %s::interval;", (lag,))
+            until = cur.fetchone()[0]
+            if table in HOLD_PENDING:
+                cur.execute(sql.SQL("""
+                    SELECT least(%s, min({col}) - interval '1 microsecond')
+                    FROM {target} WHERE status = 'pending' AND {col} <= %s;
+                """).format(col=sql.Identifier(time_col), target=target), (until, until))
+                held = cur.fetchone()[0]
+                if held < until:
+                    logging.info(f"Holding the {table} export at {held}: older rows are still pending")
+                until = held
+            if since is not None and until <= since:
+                return 0
+            query = sql.SQL("SELECT {}, {}::date FROM {} WHERE {} <= {} {}").format(
+                cols, sql.Identifier(time_col), target, sql.Identifier(time_col), sql.Literal(until),
+                sql.SQL("AND {} > {}").format(sql.Identifier(time_col), sql.Literal(since))
+                if since is not None else sql.SQL(""))
+            # named after the window start, so a rerun after a failure overwrites its own files
+            basename = f"{since.astimezone(timezone.utc):%Y%m%dT%H%M%S%f}" if since else "initial"
+
+        with tempfile.TemporaryFile(mode="w+b", dir=SPOOL_DIR) as spool:
+            reader = copy_to_reader(cur, query, columns, spool)
+            rows = 0
+            def counted():
+                nonlocal rows
+                for batch in reader:
+                    rows += batch.num_rows
+                    yield batch
+            write_partitions(pa.RecordBatchReader.from_batches(reader.schema, counted()),
+                             table, basename, replace=time_col is None)
+
+        if time_col is not None:
+            save_watermark(cur, WATERMARK_JOB, table, until, False)
+        conn.commit()
+    metrics.increment("rows_exported", rows, table=table)
+    logging.info(f"Exported {rows} {table} row(s)"
+                 + (f" up to {until}" if until else " (daily snapshot)"))
+    return rows
+
+def run_export(tables=None, lag=EXPORT_LAG):
+    tables = tables or list(EXPORTS)
+    with pooled_connection() as conn:
+        with conn, conn.cursor() as cur:
+            ensure_watermarks(cur)
+    return {table: export_table(table, lag) for table in tables}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export banking tables to date-partitioned Parquet.")
+    parser.add_argument("--table", action="append", choices=list(EXPORTS),
+                        help="table to export (repeatable, default: all)")
+    parser.add_argument("--lag", default=EXPORT_LAG, help="only export rows older than this interval")
+    args = parser.parse_args()
+    start = time.monotonic()
+    exported = run_export(args.table, args.lag)
+    metrics.write_textfile(suffix="export")
+    logging.info(f"Export finished in {time.monotonic() - start:.1f}s: {exported}")
@@ -1,134 +1,337 @@
 import uuid, random
+import io
+import argparse
 from datetime import datetime, timedelta
 from faker import Faker
 import os
-import psycopg2
-
-# read database connection info from environment
-DB_HOST     = os.getenv("POSTGRES_HOST", "db")
-DB_PORT     = os.getenv("POSTGRES_PORT", 5432)
-DB_NAME     = os.getenv("POSTGRES_DB", "banking")
-DB_USER     = os.getenv("POSTGRES_USER", "postgres")
-DB_PASSWORD = os.getenv("POSTGRES_PASSWORD", "secret")
-
-# open a connection to the database
-def connect_db():
-    return psycopg2.connect(
-        host=DB_HOST or None,
-        port=DB_PORT,
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD
-    )
+import numpy as np
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+import metrics
+from db import connect_db, pooled_connection
+from partitions import ensure_partitions
+from synthetic_data import (SCALES, parse_scale, generate_dataset, drop_customers, transaction_columns,
+                            iter_rows)
+
+# bulk loading: 'copy' (COPY FROM STDIN), 'values' (batched execute_values) or 'insert' (row by row)
+LOADER      = os.getenv("LOADER", "copy")
+BATCH_SIZE  = int(os.getenv("LOAD_BATCH_SIZE", 50_000))
+LOADERS     = ("copy", "values", "insert")
+# rows per round-trip when streaming existing rows through a server-side cursor
+READ_CHUNK  = int(os.getenv("READ_CHUNK_SIZE", 10_000))
 
 # initialize Faker for Vietnam locale
 fake = Faker("vi_VN")
 
+# escape a value for PostgreSQL COPY text format
+def _copy_value(value):
+    if value is None:
+        return r"\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+                      .replace("\n", "\\n").replace("\r", "\\r"))
+
+# yield lists of at most batch_size rows
+def _batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# stream rows through a temp staging table with COPY, then move them with
+# INSERT ... ON CONFLICT DO NOTHING so duplicates are skipped like the row-by-row path
+def copy_rows(cur, table, columns, rows, batch_size=BATCH_SIZE):
+    schema, name = table.split(".")
+    stage = sql.Identifier(f"_stage_{name}")
+    target = sql.Identifier(schema, name)
+    cols = sql.SQL(", ").join(map(sql.Identifier, columns))
+    cur.execute(sql.SQL("CREATE TEMP TABLE IF NOT EXISTS {} (LIKE {} INCLUDING DEFAULTS);")
+                .format(stage, target))
+    total = 0
+    for batch in _batches(rows, batch_size):
+        buf = io.StringIO()
+        for row in batch:
+            buf.write("\t".join(map(_copy_value, row)))
+            buf.write("\n")
+        buf.seek(0)
+        with metrics.timer("load_batch", table=table, loader="copy"):
+            cur.execute(sql.SQL("TRUNCATE {};").format(stage))
+            cur.copy_expert(sql.SQL("COPY {} ({}) FROM STDIN").format(stage, cols).as_string(cur), buf)
+            cur.execute(sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {} ON CONFLICT DO NOTHING;")
+                        .format(target, cols, cols, stage))
+        metrics.increment("rows_loaded", cur.rowcount, table=table)
+        total += cur.rowcount
+    cur.execute(sql.SQL("DROP TABLE IF EXISTS {};").format(stage))
+    return total
+
+# batched multi-row INSERTs, used where COPY is not available
+def insert_values(cur, table, columns, rows, batch_size=BATCH_SIZE):
+    schema, name = table.split(".")
+    query = sql.SQL("INSERT INTO {} ({}) VALUES %s ON CONFLICT DO NOTHING;").format(
+        sql.Identifier(schema, name), sql.SQL(", ").join(map(sql.Identifier, columns)))
+    total = 0
+    for batch in _batches(rows, batch_size):
+        with metrics.timer("load_batch", table=table, loader="values"):
+            execute_values(cur, query.as_string(cur), batch, page_size=batch_size)
+        metrics.increment("rows_loaded", cur.rowcount, table=table)
+        total += cur.rowcount
+    return total
+
+# one INSERT per row (original behaviour)
+def insert_rows(cur, table, columns, rows):
+    schema, name = table.split(".")
+    query = sql.SQL("INSERT INTO {} ({}) VALUES ({}) ON CONFLICT DO NOTHING;").format(
+        sql.Identifier(schema, name),
+        sql.SQL(", ").join(map(sql.Identifier, columns)),
+        sql.SQL(", ").join(sql.Placeholder() * len(columns)))
+    total = 0
+    with metrics.timer("load_batch", table=table, loader="insert"):
+        for row in rows:
+            cur.execute(query, row)
+            total += cur.rowcount
+    metrics.increment("rows_loaded", total, table=table)
+    return total
+
+# load generated rows into a banking table with the chosen loader
+def load_rows(cur, table, columns, rows, loader=LOADER, batch_size=BATCH_SIZE):
+    if loader == "copy":
+        return copy_rows(cur, table, columns, rows, batch_size)
+    if loader == "values":
+        return insert_values(cur, table, columns, rows, batch_size)
+    if loader == "insert":
+        return insert_rows(cur, table, columns, rows)
+    raise ValueError(f"Unknown loader {loader!r}, expected one of {LOADERS}")
+
+# stream query results through a named (server-side) cursor, chunk_size rows per fetch
+def stream_rows(conn, name, query, params=None, chunk_size=READ_CHUNK):
+    with conn.cursor(name=name) as cur:
+        cur.itersize = chunk_size
+        cur.execute(query, params)
+        yield from cur
+
+# One random row of the account-device join per pick, found through indexes
+# instead of a scan: the account is the first one with a device at or after a
+# random UUID key (wrapping around to the lowest), the device is one of its
+# owner's devices chosen by a random fraction. Accounts are weighted by the key
+# gap before them, which random UUIDs keep close to uniform.
+SAMPLE_ACCOUNT_DEVICES = """
+    SELECT a.account_id, d.device_id
+    FROM unnest(%(keys)s::uuid[], %(fractions)s::float8[]) WITH ORDINALITY AS p(key, fraction, pick)
+    CROSS JOIN LATERAL (
+        SELECT * FROM (
+            (SELECT ac.account_id, ac.customer_id FROM banking.account ac
+             WHERE ac.account_id >= p.key
+               AND EXISTS (SELECT 1 FROM banking.device d WHERE d.customer_id = ac.customer_id)
+             ORDER BY ac.account_id LIMIT 1)
+            UNION ALL
+            (SELECT ac.account_id, ac.customer_id FROM banking.account ac
+             WHERE EXISTS (SELECT 1 FROM banking.device d WHERE d.customer_id = ac.customer_id)
+             ORDER BY ac.account_id LIMIT 1)
+        ) first_at_or_after LIMIT 1
+    ) a
+    CROSS JOIN LATERAL (
+        SELECT d.device_id FROM banking.device d
+        WHERE d.customer_id = a.customer_id
+        ORDER BY d.device_id
+        OFFSET floor(p.fraction * (SELECT count(*) FROM banking.device c
+                                   WHERE c.customer_id = a.customer_id))::int
+        LIMIT 1
+    ) d
+    ORDER BY p.pick;
+"""
+
+# (account_id, device_id) rows for picks of (key fraction, device fraction) in
+# [0, 1), in the order of picks; empty when no account has a device. The result
+# depends on the rows only, not on their physical order, so a seeded draw of
+# picks gives the same sample against the same data.
+def sample_account_devices(conn, picks):
+    keys = [str(uuid.UUID(int=int(u * 2 ** 128))) for u, _ in picks]
+    with conn.cursor() as cur:
+        cur.execute(SAMPLE_ACCOUNT_DEVICES, {"keys": keys, "fractions": [v for _, v in picks]})
+        return cur.fetchall()
+
 # generate random data for customers
-def generate_customer(cur, n = 1000):
-    for _ in range(n):
-        customer_id = str(uuid.uuid4())
-        full_name = fake.name()
-        birth_date = fake.date_of_birth(minimum_age=18, maximum_age=80)
-        id_number = fake.numerify("############")      # VN ID number format
-        contact = fake.phone_number()
-        cur.execute(
-            """INSERT INTO banking.customer
-            (customer_id, full_name, birth_date, id_number, contact) VALUES (%s, %s, %s, %s, %s)
-            ON CONFLICT (customer_id) DO NOTHING;""",
-            (customer_id, full_name, birth_date, id_number, contact)
-        )
+def generate_customer(cur, n = 1000, loader=LOADER, batch_size=BATCH_SIZE):
+    def rows():
+        contacts = set()
+        while len(contacts) < n:
+            contact = fake.phone_number()
+            if contact in contacts:     # contact is UNIQUE, skip duplicates up front
+                continue
+            contacts.add(contact)
+            yield (str(uuid.uuid4()),
+                   fake.name(),
+                   fake.date_of_birth(minimum_age=18, maximum_age=80),
+                   fake.numerify("############"),      # VN ID number format
+                   contact)
+    return load_rows(cur, "banking.customer",
+                     ("customer_id", "full_name", "birth_date", "id_number", "contact"),
+                     rows(), loader, batch_size)
 
 # generate random data for accounts
-def generate_account(cur):
-    cur.execute("SELECT customer_id FROM banking.customer;")
-    for (customer_id,) in cur.fetchall():
-        for _ in range(random.randint(1, 3)):
-            account_id = str(uuid.uuid4())
-            acc_type = random.choice(["savings", "checking"])
-            cur.execute("""
-                INSERT INTO banking.account
-                (account_id, customer_id, type, balance)
-                VALUES (%s,%s,%s,%s)
-                ON CONFLICT (account_id) DO NOTHING;""",
-                (account_id, customer_id, acc_type, round(random.uniform(0, 1e8), 2))
-            )
+def generate_account(cur, loader=LOADER, batch_size=BATCH_SIZE):
+    def rows():
+        customers = stream_rows(cur.connection, "account_customers", "SELECT customer_id FROM banking.customer;")
+        for (customer_id,) in customers:
+            for _ in range(random.randint(1, 3)):
+                yield (str(uuid.uuid4()), customer_id,
+                       random.choice(["savings", "checking"]),
+                       round(random.uniform(0, 1e8), 2))
+    return load_rows(cur, "banking.account",
+                     ("account_id", "customer_id", "type", "balance"),
+                     rows(), loader, batch_size)
 
 # generate random data for device
-def generate_device(cur):
-    cur.execute("SELECT customer_id FROM banking.customer;")
-    for (customer_id,) in cur.fetchall():
-        for _ in range(random.randint(1, 2)):
-            device_id = str(uuid.uuid4())
-            device_type = random.choice(["desktop", "mobile"])
-            ip = fake.ipv4_public()
-            cur.execute("""
-                INSERT INTO banking.device
-                (device_id, customer_id, device_type, ip_address)
-                VALUES (%s,%s,%s,%s)
-                ON CONFLICT (device_id) DO NOTHING;""",
-                (device_id, customer_id, device_type, ip)
-            )
+def generate_device(cur, loader=LOADER, batch_size=BATCH_SIZE):
+    def rows():
+        customers = stream_rows(cur.connection, "device_customers", "SELECT customer_id FROM banking.customer;")
+        for (customer_id,) in customers:
+            for _ in range(random.randint(1, 2)):
+                yield (str(uuid.uuid4()), customer_id,
+                       random.choice(["desktop", "mobile"]),
+                       fake.ipv4_public())
+    return load_rows(cur, "banking.device",
+                     ("device_id", "customer_id", "device_type", "ip_address"),
+                     rows(), loader, batch_size)
+
+TX_COLUMNS = ("tx_id", "account_id", "device_id", "target_id", "amount", "method", "status")
 
 # generate random transactions
-def generate_transaction(n=1000):
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("SELECT ac.account_id, d.device_id \
-                FROM banking.account ac\
-                JOIN banking.device d ON d.customer_id = ac.customer_id;")
-    rows = cur.fetchall()
-    # generate a random transaction 
-    for _ in range(n):
-        tx_id = str(uuid.uuid4())
-        account_id, device = random.choice(rows)
-        
-        # generate random device_id
-        device_id = None
-        
-        # random amount between 10k and 10M
-        amt = round(random.uniform(10_000, 15_000_000), 0)
-        
-        # choose transaction type
-        tx_type = random.choices(['deposit', 'withdrawal', 'transfer'],
-                                    weights=[0.2, 0.3, 0.5], k=1)[0]
-        target_id = None
-        if tx_type == 'withdrawal':     # withdrawal
-            amt = -amt                  # negative for withdrawal
-        if tx_type == 'transfer':       # transfer
-            target_id = str(random.choice([a[0] for a in rows if a != account_id]))
-            device_id = str(random.choices([device, uuid.uuid4()], weights=[0.8, 0.2], k=1)[0])
-        
-        cur.execute("""
-            INSERT INTO banking.transaction
-            (tx_id, account_id, device_id, target_id, amount, method, status)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (tx_id) DO NOTHING;""",
-            (tx_id, account_id, device_id, target_id, amt,
-             random.choice(['online', 'card', 'cash']),
-             'pending')
-        )
-    conn.commit()
-    cur.close()
-    conn.close()
+# Called every minute by the Airflow DAG; the connection comes from the process's pool.
+# Memory and cost are bounded by n, not by the number of accounts: sources and
+# targets are 2n random rows of the account-device join, picked through indexes
+# (see sample_account_devices).
+def generate_transaction(n=1000, loader=LOADER, batch_size=BATCH_SIZE, vectorized=False, seed=None):
+    with pooled_connection() as conn, conn.cursor() as cur:
+        ensure_partitions(cur)
+        conn.commit()
 
-def main():
+        if vectorized:
+            # a sample of 2n join rows stands in for the whole join; every (account,
+            # device) pair acts as its own owner with a single device, which matches
+            # picking a random row of the join
+            rng = np.random.default_rng(seed)
+            sample = sample_account_devices(conn, rng.random((2 * n, 2)).tolist())
+            if not sample:
+                conn.commit()
+                return
+            pairs = len(sample)
+            columns = transaction_columns(rng, n,
+                                          np.array([r[0] for r in sample], dtype="S36"), np.arange(pairs),
+                                          np.array([r[1] for r in sample], dtype="S36"),
+                                          np.arange(pairs), np.ones(pairs, dtype=np.int64))
+            load_rows(cur, "banking.transaction", TX_COLUMNS, iter_rows(columns), loader, batch_size)
+            conn.commit()
+            return
+
+        # source (account, device) and target account rows of each transaction
+        sample = sample_account_devices(conn, [(random.random(), random.random()) for _ in range(2 * n)])
+        if not sample:
+            conn.commit()
+            return
+
+        # generate a random transaction
+        def transactions():
+            for i in range(n):
+                tx_id = str(uuid.uuid4())
+                account_id, device = sample[i]
+
+                # generate random device_id
+                device_id = None
+
+                # random amount between 10k and 10M
+                amt = round(random.uniform(10_000, 15_000_000), 0)
+
+                # choose transaction type
+                tx_type = random.choices(['deposit', 'withdrawal', 'transfer'],
+                                            weights=[0.2, 0.3, 0.5], k=1)[0]
+                target_id = None
+                if tx_type == 'withdrawal':     # withdrawal
+                    amt = -amt                  # negative for withdrawal
+                if tx_type == 'transfer':       # transfer
+                    target_id = str(sample[n + i][0])
+                    device_id = str(random.choices([device, uuid.uuid4()], weights=[0.8, 0.2], k=1)[0])
+
+                yield (tx_id, account_id, device_id, target_id, amt,
+                       random.choice(['online', 'card', 'cash']),
+                       'pending')
+
+        load_rows(cur, "banking.transaction", TX_COLUMNS, transactions(), loader, batch_size)
+        conn.commit()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate synthetic banking data.")
+    parser.add_argument("--loader", choices=LOADERS, default=LOADER,
+                        help="how rows are written: COPY, batched VALUES or one INSERT per row")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="rows per COPY / VALUES batch")
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--transactions", type=int, default=1000)
+    parser.add_argument("--scale",
+                        help=f"use the vectorized generator at a preset {list(SCALES)} or "
+                             "'customers=N,accounts=1-3,devices=1-2,transactions=N'")
+    parser.add_argument("--seed", type=int, help="seed for reproducible data")
+    parser.add_argument("--vectorized", action="store_true",
+                        help="draw the --transactions with NumPy instead of row by row (ignored with --scale)")
+    return parser.parse_args()
+
+# Mask of generated contacts that already belong to a customer in the database.
+# Contacts are only unique within one generated dataset; those customers would be
+# skipped by ON CONFLICT while their accounts and devices still reference them.
+def existing_contacts(cur, contacts, chunk_size=READ_CHUNK):
+    found = set()
+    for start in range(0, len(contacts), chunk_size):
+        cur.execute("SELECT contact FROM banking.customer WHERE contact = ANY(%s);",
+                    (contacts[start:start + chunk_size].tolist(),))
+        found.update(contact for (contact,) in cur.fetchall())
+    return np.isin(contacts, list(found)) if found else np.zeros(len(contacts), dtype=bool)
+
+# generate all tables in memory with NumPy, then bulk load them
+def generate_scaled(cur, scale, seed=None, loader=LOADER, batch_size=BATCH_SIZE):
+    dataset = generate_dataset(scale, seed)
+    taken = existing_contacts(cur, dataset["customer"]["contact"])
+    if taken.any():
+        print(f"Skipping {int(taken.sum())} generated customer(s) whose contact already exists.")
+        dataset = drop_customers(dataset, taken)
+    for table, columns in dataset.items():
+        load_rows(cur, f"banking.{table}", tuple(columns), iter_rows(columns), loader, batch_size)
+
+# generate customers, accounts, devices and transactions; also the Airflow task callable
+def generate_all(customers=1000, transactions=1000, scale=None, seed=None, loader=LOADER,
+                 batch_size=BATCH_SIZE, vectorized=False):
+    if seed is not None:
+        random.seed(seed)
+        fake.seed_instance(seed)
     conn = connect_db()
     with conn:
         cur = conn.cursor()
+        ensure_partitions(cur)
 
         # generate data
-        generate_customer(cur, 1000)
-        generate_account(cur)
-        generate_device(cur)
-        
+        if scale:
+            generate_scaled(cur, parse_scale(scale), seed, loader, batch_size)
+        else:
+            generate_customer(cur, customers, loader, batch_size)
+            generate_account(cur, loader, batch_size)
+            generate_device(cur, loader, batch_size)
+
         # commit changes and close connection
         conn.commit()
         cur.close()
     conn.close()
-    generate_transaction()
+    if not scale:
+        generate_transaction(transactions, loader, batch_size, vectorized, seed)
+
+def main():
+    args = parse_args()
+    generate_all(args.customers, args.transactions, args.scale, args.seed, args.loader, args.batch_size,
+                 args.vectorized)
+    metrics.write_textfile(suffix="generate_data")
     print("Data generation completed successfully.")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,230 @@
+"""
+load_generator.py
+
+Sustained transaction load for capacity planning of monitoring_audit.py and the
+database. Unlike generate_transaction (one batch stamped "now"), this inserts
+pending transactions continuously, one COPY per tick:
+
+  generate  rate(t) = --rate * PROFILE[hour of the simulated clock] * burst
+            Arrivals per tick are Poisson with that mean; bursts start with
+            probability --burst-prob per tick, multiply the rate by
+            --burst-factor and last an exponential --burst-seconds on average.
+            The simulated clock starts at --start-hour and runs --time-scale
+            times faster than the wall clock, so a day's profile can be played
+            in minutes. Everything is drawn from one seeded generator and the
+            account/device sample does not depend on physical row order: the
+            same --seed and options against the same data produce the same
+            transactions.
+
+  replay    re-inserts a recorded log (see --record and --capture) at --speed
+            times its original pace.
+
+A log is a CSV of (offset seconds, tx_id, account_id, device_id, target_id,
+amount, method). --record writes the generated load; --capture writes the
+transactions already in banking.transaction between two timestamps.
+
+With --max-backlog, generation pauses while that many transactions are still
+pending, so a run measures the rate the processor sustains instead of growing
+the queue without bound; paused time is reported.
+"""
+
+import os
+import csv
+import uuid
+import time
+import logging
+import argparse
+from contextlib import nullcontext
+import numpy as np
+import metrics
+from db import pooled_connection
+from partitions import ensure_partitions
+from generate_data import TX_COLUMNS, load_rows, sample_account_devices
+from synthetic_data import transaction_columns, iter_rows
+from monitoring_audit import pending_backlog
+
+TICK_SECONDS = float(os.getenv("LOAD_TICK_SECONDS", 1.0))
+POOL_SIZE    = int(os.getenv("LOAD_POOL_SIZE", 10_000))      # account/device rows drawn per run
+LOG_COLUMNS  = ("offset",) + TX_COLUMNS[:-1]                 # status is always 'pending'
+
+# relative rate per hour of day: quiet nights, morning and evening peaks
+PROFILE = np.array([0.15, 0.10, 0.08, 0.08, 0.10, 0.20, 0.45, 0.80,
+                    1.20, 1.50, 1.40, 1.30, 1.40, 1.20, 1.10, 1.10,
+                    1.20, 1.40, 1.60, 1.70, 1.50, 1.10, 0.70, 0.35])
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s %(levelname)s %(message)s",
+    handlers=[logging.StreamHandler()]
+)
+
+# Tick counts of the generated load: yields (tick index, number of transactions).
+def arrivals(rng, rate, duration, start_hour=0.0, time_scale=1.0,
+             burst_prob=0.0, burst_factor=5.0, burst_seconds=10.0, tick=TICK_SECONDS):
+    burst_left = 0.0
+    for k in range(int(duration / tick)):
+        hour = int(start_hour + k * tick * time_scale / 3600) % 24
+        if burst_left <= 0 and burst_prob and rng.random() < burst_prob:
+            burst_left = rng.exponential(burst_seconds)
+        factor = burst_factor if burst_left > 0 else 1.0
+        burst_left -= tick
+        yield k, int(rng.poisson(rate * PROFILE[hour] * factor * tick))
+
+# Seeded sample of the account-device join used as sources and targets; each
+# (account, device) pair acts as its own owner, as in the vectorized generator.
+def sample_pool(conn, rng, size=POOL_SIZE):
+    sample = sample_account_devices(conn, rng.random((size, 2)).tolist())
+    conn.commit()
+    if not sample:
+        raise RuntimeError("No accounts with devices; seed the database with generate_data.py first")
+    pairs = len(sample)
+    return (np.array([r[0] for r in sample], dtype="S36"), np.arange(pairs),
+            np.array([r[1] for r in sample], dtype="S36"), np.arange(pairs), np.ones(pairs, dtype=np.int64))
+
+class Pacer:
+    """Wall-clock schedule of a run: waits for each tick and for the processor
+    to drain the backlog, and keeps the run statistics."""
+
+    def __init__(self, cur, max_backlog=None):
+        self.cur, self.max_backlog = cur, max_backlog
+        self.start = time.monotonic()
+        self.inserted = 0
+        self.paused = 0.0
+        self.late_ticks = 0
+
+    def wait(self, due):
+        delay = self.start + self.paused + due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        elif delay < -TICK_SECONDS:
+            self.late_ticks += 1        # inserts cannot keep up with the schedule
+        if self.max_backlog:
+            stalled = None
+            while pending_backlog(self.cur, self.max_backlog) >= self.max_backlog:
+                self.cur.connection.commit()
+                stalled = stalled or time.monotonic()
+                time.sleep(TICK_SECONDS)
+            self.cur.connection.commit()
+            if stalled:
+                self.paused += time.monotonic() - stalled
+
+    def insert(self, rows):
+        rows = list(rows)
+        if not rows:
+            return
+        with metrics.timer("load_tick"):
+            load_rows(self.cur, "banking.transaction", TX_COLUMNS, rows, "copy")
+            self.cur.connection.commit()
+        self.inserted += len(rows)
+        metrics.increment("load_generated", len(rows))
+
+    def summary(self):
+        elapsed = time.monotonic() - self.start
+        return {
+            "inserted": self.inserted,
+            "elapsed_s": round(elapsed, 1),
+            "paused_s": round(self.paused, 1),
+            "rate_tx_s": round(self.inserted / max(elapsed - self.paused, 1e-9), 1),
+            "late_ticks": self.late_ticks,
+        }
+
+def generate_load(rate, duration, seed=None, start_hour=0.0, time_scale=1.0, burst_prob=0.0,
+                  burst_factor=5.0, burst_seconds=10.0, max_backlog=None, record=None):
+    rng = np.random.default_rng(seed)
+    with pooled_connection() as conn, conn.cursor() as cur, \
+            (open(record, "w", newline="") if record else nullcontext()) as f:
+        ensure_partitions(cur)
+        conn.commit()
+        pool = sample_pool(conn, rng)
+        log = csv.writer(f) if f else None
+        if log:
+            log.writerow(LOG_COLUMNS)
+        pacer = Pacer(cur, max_backlog)
+        for k, n in arrivals(rng, rate, duration, start_hour, time_scale,
+                             burst_prob, burst_factor, burst_seconds):
+            rows = list(iter_rows(transaction_columns(rng, n, *pool))) if n else []
+            pacer.wait(k * TICK_SECONDS)
+            pacer.insert(rows)
+            if log:
+                log.writerows((round(k * TICK_SECONDS, 3),) + row[:-1] for row in rows)
+    summary = pacer.summary()
+    logging.info(f"Generated load: {summary}")
+    return summary
+
+def replay_log(path, speed=1.0, max_backlog=None, keep_ids=False):
+    with open(path, newline="") as f, pooled_connection() as conn, conn.cursor() as cur:
+        ensure_partitions(cur)
+        conn.commit()
+        reader = csv.reader(f)
+        next(reader)                                    # header
+        pacer = Pacer(cur, max_backlog)
+        due, rows = None, []
+        for record in reader:
+            if not record:
+                continue
+            offset = float(record[0]) / speed
+            tick = offset - offset % TICK_SECONDS
+            if due is not None and tick != due:
+                pacer.wait(due)
+                pacer.insert(rows)
+                rows = []
+            due = tick
+            tx_id, account_id, device_id, target_id, amount, method = record[1:]
+            rows.append((tx_id if keep_ids else str(uuid.uuid4()), account_id, device_id or None,
+                         target_id or None, amount, method, "pending"))
+        if rows:
+            pacer.wait(due)
+            pacer.insert(rows)
+    summary = pacer.summary()
+    logging.info(f"Replayed {path} at {speed}x: {summary}")
+    return summary
+
+# Write the transactions of [since, until) to a log, offsets relative to the first one.
+def capture_log(path, since, until):
+    with open(path, "w", newline="") as f, pooled_connection() as conn, conn.cursor() as cur:
+        csv.writer(f).writerow(LOG_COLUMNS)
+        f.flush()
+        cur.copy_expert(cur.mogrify("""
+            COPY (
+                SELECT extract(epoch FROM timestamp - min(timestamp) OVER ())::numeric(12, 3),
+                       tx_id, account_id, device_id, target_id, amount, method
+                FROM banking.transaction
+                WHERE timestamp >= %s AND timestamp < %s
+                ORDER BY timestamp
+            ) TO STDOUT WITH (FORMAT csv, HEADER false)
+        """, (since, until)).decode(), f)
+        conn.commit()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate or replay sustained transaction load.")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--rate", type=float, help="base transactions per second (generate mode)")
+    mode.add_argument("--replay", metavar="LOG", help="replay a recorded log")
+    mode.add_argument("--capture", nargs=3, metavar=("LOG", "SINCE", "UNTIL"),
+                      help="write the transactions of [SINCE, UNTIL) to a log")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of generated load")
+    parser.add_argument("--seed", type=int, help="seed for a replayable run")
+    parser.add_argument("--start-hour", type=float, default=0.0,
+                        help="hour of day the simulated clock starts at (default: midnight)")
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="simulated seconds per wall second (e.g. 1440 plays a day in a minute)")
+    parser.add_argument("--burst-prob", type=float, default=0.0, help="probability per tick that a burst starts")
+    parser.add_argument("--burst-factor", type=float, default=5.0, help="rate multiplier during bursts")
+    parser.add_argument("--burst-seconds", type=float, default=10.0, help="mean burst length")
+    parser.add_argument("--record", metavar="LOG", help="also write the generated load to a log")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed-up")
+    parser.add_argument("--keep-ids", action="store_true", help="replay with the recorded tx_ids")
+    parser.add_argument("--max-backlog", type=int,
+                        help="pause while at least this many transactions are pending")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.capture:
+        capture_log(*args.capture)
+    elif args.replay:
+        replay_log(args.replay, args.speed, args.max_backlog, args.keep_ids)
+    else:
+        generate_load(args.rate, args.duration, args.seed, args.start_hour, args.time_scale,
+                      args.burst_prob, args.burst_factor, args.burst_seconds, args.max_backlog, args.record)
+    metrics.write_textfile(suffix="load_generator")
@@ -0,0 +1,188 @@
+"""
+metrics.py
+
+Timers and counters for the pipeline hot paths, exported in Prometheus text
+format (to a file for the node_exporter textfile collector, or on a local HTTP
+endpoint) and as a plain dict for Airflow XCom.
+
+Disabled unless METRICS_ENABLED is set: `timed` then returns the function
+unchanged and `timer` a shared no-op context manager, so instrumented code
+pays nothing.
+"""
+
+import os
+import time
+import threading
+import functools
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENABLED  = os.getenv("METRICS_ENABLED", "").lower() in ("1", "true", "yes")
+TEXTFILE = os.getenv("METRICS_TEXTFILE")           # e.g. /var/lib/node_exporter/banking.prom
+PORT     = int(os.getenv("METRICS_PORT", 0))       # 0: no HTTP endpoint
+PREFIX   = "banking"
+
+_lock     = threading.Lock()
+_timers   = {}      # (name, labels) -> [count, total seconds, max seconds]
+_counters = {}      # (name, labels) -> value
+_NOOP     = nullcontext()
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+# Record one duration of a timer.
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        stat = _timers.get(key)
+        if stat is None:
+            _timers[key] = [1, seconds, seconds]
+        else:
+            stat[0] += 1
+            stat[1] += seconds
+            if seconds > stat[2]:
+                stat[2] = seconds
+
+def increment(name, value=1, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+class _Timer:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name, labels):
+        self.name, self.labels = name, labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+# Time a block: `with metrics.timer("load_batch", table="banking.customer"): ...`
+def timer(name, **labels):
+    return _Timer(name, labels) if ENABLED else _NOOP
+
+# Time every call of a function.
+def timed(name):
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+def reset():
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+# Raw state, picklable, e.g. to send from a worker process to its parent.
+def snapshot():
+    with _lock:
+        return {"timers": {k: list(v) for k, v in _timers.items()}, "counters": dict(_counters)}
+
+# Add a worker's snapshot to this process's metrics.
+def merge(state):
+    with _lock:
+        for key, (count, total, peak) in state["timers"].items():
+            stat = _timers.setdefault(key, [0, 0.0, 0.0])
+            stat[0] += count
+            stat[1] += total
+            stat[2] = max(stat[2], peak)
+        for key, value in state["counters"].items():
+            _counters[key] = _counters.get(key, 0) + value
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in labels) + "}"
+
+def _display(name, labels):
+    return name + "".join(f"[{k}={v}]" for k, v in labels)
+
+# JSON-serializable summary, returned by Airflow callables so it lands in XCom.
+def summary():
+    with _lock:
+        timers = {
+            _display(name, labels): {
+                "count": count,
+                "total_s": round(total, 6),
+                "mean_ms": round(total / count * 1000, 3),
+                "max_ms": round(peak * 1000, 3),
+            }
+            for (name, labels), (count, total, peak) in _timers.items()
+        }
+        counters = {_display(name, labels): value for (name, labels), value in _counters.items()}
+    return {"timers": timers, "counters": counters}
+
+# Prometheus text exposition format.
+def render():
+    lines = []
+    with _lock:
+        timers = sorted(_timers.items())
+        counters = sorted(_counters.items())
+    seen = set()
+    for (name, labels), (count, total, peak) in timers:
+        metric = f"{PREFIX}_{name}_seconds"
+        if metric not in seen:
+            seen.add(metric)
+            lines.append(f"# TYPE {metric} summary")
+            lines.append(f"# TYPE {metric}_max gauge")
+        lines.append(f"{metric}_count{_label_text(labels)} {count}")
+        lines.append(f"{metric}_sum{_label_text(labels)} {total:.6f}")
+        lines.append(f"{metric}_max{_label_text(labels)} {peak:.6f}")
+    for (name, labels), value in counters:
+        metric = f"{PREFIX}_{name}_total"
+        if metric not in seen:
+            seen.add(metric)
+            lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}{_label_text(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+# Write the metrics atomically to path (default METRICS_TEXTFILE); a suffix naming
+# the script or shard keeps processes from overwriting each other's files.
+def write_textfile(path=None, suffix=None):
+    path = path or TEXTFILE
+    if not ENABLED or not path:
+        return None
+    if suffix is not None:
+        root, ext = os.path.splitext(path)
+        path = f"{root}-{suffix}{ext}"
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(render())
+    os.replace(tmp, path)
+    return path
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# Serve /metrics from a daemon thread (default METRICS_PORT); returns the server or None.
+def serve(port=None):
+    port = PORT if port is None else port
+    if not ENABLED or not port:
+        return None
+    server = ThreadingHTTPServer(("0.0.0.0", port), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -7,17 +7,36 @@ import os
 import uuid
 import random
 import logging
-from datetime import datetime
+import time
+import select
+import signal
+import argparse
+import multiprocessing
+from datetime import datetime, timezone
 import psycopg2
-from psycopg2 import sql
-
-DB_HOST     = os.getenv("POSTGRES_HOST", "db")
-DB_PORT     = os.getenv("POSTGRES_PORT", 5432)
-DB_NAME     = os.getenv("POSTGRES_DB", "banking")
-DB_USER     = os.getenv("POSTGRES_USER", "postgres")
-DB_PASSWORD = os.getenv("POSTGRES_PASSWORD", "secret")
+import metrics
+from db import connect_db, pooled_connection, execute_prepared
+from partitions import ensure_partitions
 
 HIGH_VALUE_THRESHOLD = 10_000_000  # VND
+CUMULATIVE_THRESHOLD = 20_000_000  # VND per customer per day
+
+WORKERS    = int(os.getenv("PROCESS_WORKERS", 1))
+BATCH_SIZE = int(os.getenv("PROCESS_BATCH_SIZE", 500))
+# transactions grouped into one commit; each runs in its own savepoint
+COMMIT_EVERY = int(os.getenv("PROCESS_COMMIT_EVERY", 50))
+# seed for simulated authentication; when set the outcome depends only on the tx_id
+AUTH_SEED  = os.getenv("AUTH_SEED")
+
+# streaming mode: wake up on NOTIFY banking_tx_pending, or poll after this many seconds
+STREAM_POLL_SECONDS = float(os.getenv("STREAM_POLL_SECONDS", 5))
+MAX_BACKLOG         = int(os.getenv("STREAM_MAX_BACKLOG", 100_000))
+
+# Shard ownership: the customer hash space is split into SHARD_SLOTS advisory
+# locks (first key SHARD_LOCK_CLASS); shard s of n owns the slots t with
+# t % n == s, so any shard counts dividing SHARD_SLOTS exclude each other.
+SHARD_SLOTS      = 64
+SHARD_LOCK_CLASS = 20_250_720
 
 logging.basicConfig(
     level=logging.INFO,
@@ -25,36 +44,87 @@ logging.basicConfig(
     handlers=[logging.StreamHandler()]
 )
 
-def connect_db():
-    return psycopg2.connect(
-        host=DB_HOST or None,
-        port=DB_PORT,
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD
-    )
-
 # Check if a device is trusted for a given account
+@metrics.timed("check_device_trust")
 def check_device_trust(cur, account_id, device_id):
     cur.execute("""
                 SELECT ac.account_id, d.device_id 
                 FROM banking.account ac
                 JOIN banking.device d ON d.customer_id = ac.customer_id
-                WHERE d.device_id = %s AND ac.account_id = %s;
+                WHERE d.device_id = %s AND ac.account_id = %s AND d.active;
             """, (device_id, account_id))
+    return cur.rowcount > 0
+
+# Active devices per customer, so device trust is a set lookup.
+# Devices belong to customers, so an account's trusted devices are its owner's.
+# Customers are loaded on their first lookup, so memory follows the customers a
+# worker actually sees. The index LISTENs on the banking_device channel (see
+# sql/schema.sql) and drops a customer's entry when one of their devices is
+# added, changed or removed; it is reloaded on the next lookup. A miss on a
+# cached entry is re-checked in the DB, since a device added just now may
+# precede its NOTIFY.
+class DeviceTrustIndex:
+    def __init__(self, conn, listen=True):
+        self.conn = conn
+        self.listening = listen
+        self.devices = {}
+        if listen:
+            with conn.cursor() as cur:
+                cur.execute("LISTEN banking_device;")
+            conn.commit()
+
+    # Forget one customer's devices, or everything.
+    def invalidate(self, customer_id=None):
+        if customer_id is None:
+            self.devices.clear()
+        else:
+            self.devices.pop(customer_id, None)
+
+    # Apply device change notifications received since the last call.
+    def poll(self):
+        self.conn.poll()
+        while self.conn.notifies:
+            self.invalidate(self.conn.notifies.pop(0).payload or None)
+
+    def _load(self, cur, customer_id):
+        cur.execute("SELECT device_id FROM banking.device WHERE customer_id = %s AND active;",
+                    (customer_id,))
+        devices = self.devices[customer_id] = {d for (d,) in cur.fetchall()}
+        return devices
+
+    @metrics.timed("device_trust_lookup")
+    def is_trusted(self, cur, customer_id, account_id, device_id):
+        if self.listening:
+            self.poll()
+        devices = self.devices.get(customer_id)
+        if devices is None:
+            return device_id in self._load(cur, customer_id)     # just read from the DB
+        if device_id in devices:
+            return True
+        if check_device_trust(cur, account_id, device_id):
+            devices.add(device_id)
+            return True
+        return False
+
+# Simulate strong authentication: (succeeded, method for high-value transfers).
+# With AUTH_SEED set, reruns and the stored procedure path agree on the same data.
+def simulate_auth(tx_id):
+    rng = random.Random(f"{AUTH_SEED}:{tx_id}") if AUTH_SEED is not None else random
+    return rng.choice([True, False]), rng.choice(['Biometric', 'OTP'])
 
 # Update the balance of an account in the database.
 def update_account_balance(cur, account_id, amount):
     # Update the balance of an account in the database.
-    cur.execute("""
-        UPDATE banking.account
-        SET balance = balance + %s
-        WHERE account_id = %s AND balance + %s >= 0;
-    """, (amount, account_id, amount))
+    execute_prepared(cur, "update_balance", (amount, account_id))
 
 # Update the status of a transaction in the database.
-def update_transaction_status(cur, tx_id, status):
+# Passing the transaction's timestamp lets PostgreSQL prune to its partition
+# and uses the prepared statement.
+def update_transaction_status(cur, tx_id, status, tx_time=None):
     # Update the status of a transaction in the database.
+    if tx_time is not None:
+        execute_prepared(cur, "update_status", (status, tx_id, tx_time))
+        return
     cur.execute("""
         UPDATE banking.transaction
         SET status = %s
@@ -65,37 +135,86 @@ def update_transaction_status(cur, tx_id, status):
 def generate_risk(cur, tx_id, severity=1, tag_reason=''):
     # Generate a risk ID for a transaction.
     risk_id = str(uuid.uuid4())
-    cur.execute("""
-            INSERT INTO banking.risk_tag (risk_id, tx_id, severity, tag_reason)
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT (risk_id) DO NOTHING;
-        """, (risk_id, tx_id, severity, tag_reason))
+    execute_prepared(cur, "insert_risk", (risk_id, tx_id, severity, tag_reason))
+
+# Per-customer total of today's successful transaction amounts, kept in process.
+# Warmed with one aggregate query, updated as transactions succeed and re-warmed
+# when the database day rolls over, so the cumulative check needs no query.
+class DailySpendTracker:
+    def __init__(self, cur):
+        self.warm(cur)
+
+    # Load today's spend per customer; "today" is the database's day. Transfers
+    # a checkpointed run authenticated but has not settled yet count as spent,
+    # as they did in that run's tracker (credit_step does not record them again).
+    def warm(self, cur):
+        cur.execute("SELECT date_trunc('day', now()), date_trunc('day', now()) + interval '1 day';")
+        self.day_start, self.day_end = cur.fetchone()
+        cur.execute("""
+            SELECT acc.customer_id, SUM(ABS(tx.amount))
+            FROM banking.transaction tx
+            JOIN banking.account acc ON acc.account_id = tx.account_id
+            WHERE tx.timestamp >= %s AND tx.timestamp < %s
+              AND (tx.status = 'success'
+                   OR (tx.status = 'pending'
+                       AND EXISTS (SELECT 1 FROM banking.tx_state s
+                                   WHERE s.idempotency_key = tx.idempotency_key
+                                     AND s.state = 'authenticated')))
+            GROUP BY acc.customer_id;
+        """, (self.day_start, self.day_end))
+        self.spent = dict(cur.fetchall())
+
+    def _is_today(self, cur, tx_time):
+        if datetime.now(timezone.utc) >= self.day_end:
+            self.warm(cur)
+        return self.day_start <= tx_time < self.day_end
+
+    # Today's spend of the customer, or None when the transaction is not from today.
+    def spent_today(self, cur, customer_id, tx_time):
+        if not self._is_today(cur, tx_time):
+            return None
+        return self.spent.get(customer_id, 0)
+
+    # Count a transaction that has just succeeded.
+    def record(self, cur, customer_id, tx_time, amount):
+        if self._is_today(cur, tx_time):
+            self.spent[customer_id] = self.spent.get(customer_id, 0) + abs(amount)
 
 # Define the authentication type based on transaction amount.
-def define_high_value_transaction(cur, tx_id, amount):
+# With a tracker the cumulative daily check is answered from memory.
+@metrics.timed("define_high_value_transaction")
+def define_high_value_transaction(cur, tx_id, amount, tracker=None, customer_id=None, tx_time=None,
+                                  strong_method=None):
     # Tag high-value transactions for additional scrutiny.
     # This function inserts a risk tag into the database if the amount exceeds the threshold.
     
     if amount > HIGH_VALUE_THRESHOLD:
         logging.warning(f"Transaction {tx_id} tagged as high value due to amount {amount}.")
-        return 2, random.choice(['Biometric', 'OTP'])      # Strong authentication required for high-value transactions
+        return 2, strong_method or random.choice(['Biometric', 'OTP'])     # Strong authentication required for high-value transactions
     
-    cur.execute("""
+    if tracker is not None:
+        spent = tracker.spent_today(cur, customer_id, tx_time)
+        exceeded = spent is not None and spent + amount > CUMULATIVE_THRESHOLD
+        row = (customer_id, tx_time, spent)
+    else:
+        cur.execute("""
             WITH cte AS (
                 SELECT acc.customer_id cus, tx.tx_id tx_id, tx.status status, tx.amount amt, DATE(tx.timestamp) tm
                 FROM banking.account acc
                 JOIN banking.transaction tx ON acc.account_id = tx.account_id 
-                WHERE DATE(tx.timestamp) = DATE(NOW())
+                WHERE tx.timestamp >= date_trunc('day', now())
+                  AND tx.timestamp < date_trunc('day', now()) + interval '1 day'
             )
             SELECT cus, tm, sum(abs(amt))
             FROM cte
             WHERE cus = (SELECT cus FROM cte WHERE tx_id = %s) and status = 'success'
             GROUP BY cus, tm
-            HAVING sum(abs(amt)) + %s > 20000000;
-        """, (tx_id, amount))
-    
-    if cur.rowcount > 0:                  # Cumulative amount exceeds 20,000,000 VND
-        row = cur.fetchone()
+            HAVING sum(abs(amt)) + %s > %s;
+        """, (tx_id, amount, CUMULATIVE_THRESHOLD))
+        exceeded = cur.rowcount > 0
+        row = cur.fetchone() if exceeded else None
+
+    if exceeded:                          # Cumulative amount exceeds 20,000,000 VND
         logging.warning(f"Transaction {tx_id} tagged as high value due to cumulative amount exceeding 20,000,000 VND.")
         if (row[2] + amount) // 10000000 > row[2] // 10000000:
             return 3, 'Biometric'         # Biometric authentication for each exceeding 10,000,000 VND
@@ -104,90 +223,679 @@ def define_high_value_transaction(cur, tx_id, amount):
     return 1, 'PIN'            # Default authentication for regular transactions
 
 # Process a transaction based on its type and perform necessary checks.
-def process_transaction(conn, cur, tx):
-    tx_id, account_id, device_id, target_id, amount = tx
+# A transfer is one atomic unit: the debit runs in a savepoint that is rolled back
+# if authentication fails, so the failure path writes its audit rows once and
+# leaves the rest of the connection's transaction alone.
+@metrics.timed("process_transaction")
+def process_transaction(conn, cur, tx, tracker=None, devices=None):
+    tx_id, account_id, device_id, target_id, amount, tx_time, customer_id = tx
     
     if target_id:           # Transfer
         # Check if the device is trusted for the account
-        check_device_trust(cur, account_id, device_id)
-        if cur.rowcount == 0:
-            update_transaction_status(cur, tx_id, 'failed')
+        if devices is not None:
+            trusted = devices.is_trusted(cur, customer_id, account_id, device_id)
+        else:
+            trusted = check_device_trust(cur, account_id, device_id)
+        if not trusted:
+            update_transaction_status(cur, tx_id, 'failed', tx_time)
             generate_risk(cur, tx_id, 4, 'Untrusted device')
             raise ValueError(f"Device {device_id} is not trusted.")
         
         # Begin transaction
+        cur.execute("SAVEPOINT transfer;")
         update_account_balance(cur, account_id, -amount)    # Deduct from source account
         if cur.rowcount == 0:
-            update_transaction_status(cur, tx_id, 'failed')
+            cur.execute("RELEASE SAVEPOINT transfer;")
+            update_transaction_status(cur, tx_id, 'failed', tx_time)
             raise ValueError(f"Transfer Fail (insufficient balance)")
         
         # Simulate strong authentication failure or success
-        status = random.choice(['success', 'failed'])
-
-        # Create a transaction_auth record
-        auth_id = str(uuid.uuid4())
-        severity, auth_type = define_high_value_transaction(cur, tx_id, amount)
-        cur.execute("""
-            INSERT INTO banking.auth_log (auth_id, tx_id, auth_type)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (auth_id) DO NOTHING;
-        """, (auth_id, tx_id, auth_type))
+        auth_ok, strong_method = simulate_auth(tx_id)
+        severity, auth_type = define_high_value_transaction(cur, tx_id, amount, tracker, customer_id, tx_time,
+                                                            strong_method)
 
         # Update transaction status based on authentication
-        if status == 'failed':
-            conn.rollback()                 # Rollback if authentication fails
-            update_transaction_status(cur, tx_id, 'failed')
+        if not auth_ok:
+            cur.execute("ROLLBACK TO SAVEPOINT transfer;")     # undo the debit only
+            cur.execute("RELEASE SAVEPOINT transfer;")
+            update_transaction_status(cur, tx_id, 'failed', tx_time)
             if severity == 2:
                 generate_risk(cur, tx_id, severity, 'High value transaction')
             elif severity == 3:
                 generate_risk(cur, tx_id, severity, 'Cumulative amount exceeds 20,000,000 VND')
-            cur.execute("""
-                INSERT INTO banking.auth_log (auth_id, tx_id, auth_type, success_flag)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (auth_id) DO NOTHING;
-            """, (auth_id, tx_id, auth_type, False))
-
+            execute_prepared(cur, "insert_auth_log", (str(uuid.uuid4()), tx_id, auth_type, False))
             raise ValueError(f"Authentication Failed")
         else:
-            cur.execute("""
-                UPDATE banking.auth_log
-                SET success_flag = TRUE
-                WHERE auth_id = %s;
-            """, (auth_id,))
             update_account_balance(cur, target_id, amount) 
+            cur.execute("RELEASE SAVEPOINT transfer;")
+            execute_prepared(cur, "insert_auth_log", (str(uuid.uuid4()), tx_id, auth_type, True))
             logging.info(f"Transaction {tx_id}: Transfer Success")
             
     else:                           # No authentication needed for deposit/withdrawal
         if amount < 0:              # Withdrawal
             update_account_balance(cur, account_id, amount) 
             if cur.rowcount == 0:   # Insufficient balance
-                update_transaction_status(cur, tx_id, 'failed')
+                update_transaction_status(cur, tx_id, 'failed', tx_time)
                 raise ValueError(f"Withdrawal Fail (insufficient balance)")
         else:                       # Deposit 
             update_account_balance(cur, account_id, amount)
             logging.info(f"Transaction {tx_id}: Deposit Success")
     
     # Transaction completed successfully, update status
-    update_transaction_status(cur, tx_id, 'success')
+    update_transaction_status(cur, tx_id, 'success', tx_time)
+    if tracker is not None:
+        tracker.record(cur, customer_id, tx_time, amount)
     
-if __name__ == "__main__":
-    conn = connect_db()
-    with conn:
-        cur = conn.cursor()
+# Claim the next batch of pending transactions of one shard, oldest first.
+# Transactions are sharded by the source account's customer, and a shard is
+# processed by the single worker holding its lock (see lock_shard), so each
+# account's transactions are processed in order and each customer's daily spend
+# is owned by one tracker; rows locked by another run are skipped.
+# Transactions a checkpointed run has started (a banking.tx_state row) are only
+# claimed in checkpointed mode, which also returns their idempotency key and state.
+def claim_batch(cur, shard=0, n_shards=1, batch_size=BATCH_SIZE, after=None, checkpointed=False):
+    after_ts, after_id = after or (None, None)
+    cur.execute("""
+        SELECT tx.tx_id, tx.account_id, tx.device_id, tx.target_id, tx.amount, tx.timestamp,
+               acc.customer_id""" + (", tx.idempotency_key, s.state" if checkpointed else "") + """
+        FROM banking.transaction tx
+        JOIN banking.account acc ON acc.account_id = tx.account_id
+        LEFT JOIN banking.tx_state s ON s.idempotency_key = tx.idempotency_key
+        WHERE tx.status = 'pending'
+          AND (%(checkpointed)s OR s.idempotency_key IS NULL)
+          AND (hashtext(acc.customer_id::text) & 2147483647) %% %(n_shards)s = %(shard)s
+          AND (%(after_ts)s::timestamptz IS NULL
+               OR (tx.timestamp, tx.tx_id) > (%(after_ts)s, %(after_id)s::uuid))
+        ORDER BY tx.timestamp, tx.tx_id
+        LIMIT %(limit)s
+        FOR UPDATE OF tx SKIP LOCKED;
+    """, {"n_shards": n_shards, "shard": shard, "after_ts": after_ts, "after_id": after_id,
+          "limit": batch_size, "checkpointed": checkpointed})
+    return cur.fetchall()
+
+# Pending transactions of one shard as a stream of claimed batches: keyset
+# pagination over (timestamp, tx_id), so memory is bounded by batch_size however
+# large the backlog. The caller commits between batches, releasing the claim.
+def iter_pending_batches(cur, shard=0, n_shards=1, batch_size=BATCH_SIZE, checkpointed=False):
+    after = None
+    while True:
+        rows = claim_batch(cur, shard, n_shards, batch_size, after, checkpointed)
+        if not rows:
+            return
+        yield rows
+        after = (rows[-1][5], rows[-1][0])       # keyset: never revisit rows left pending by errors
+
+# Re-lock a claimed transaction; locks of the batch are released by the previous commit.
+# Outside checkpointed mode a transaction a checkpointed run has started since the
+# claim (and possibly debited) is left to that mode.
+def lock_pending(cur, tx_id, tx_time, checkpointed=False):
+    cur.execute("""
+        SELECT 1 FROM banking.transaction tx
+        WHERE tx.tx_id = %s AND tx.timestamp = %s AND tx.status = 'pending'
+          AND (%s OR NOT EXISTS (SELECT 1 FROM banking.tx_state s
+                                 WHERE s.idempotency_key = tx.idempotency_key))
+        FOR UPDATE OF tx SKIP LOCKED;
+    """, (tx_id, tx_time, checkpointed))
+    return cur.rowcount > 0
+
+# Settle a batch of pending deposits/withdrawals of one shard with set-based SQL.
+# Transactions are applied per account in (timestamp, tx_id) order; a withdrawal
+# fails exactly when the running balance would go negative, as in the row-by-row
+# path. Deposits/withdrawals that come after a pending transfer touching the same
+# account are left for process_transaction so the interleaving stays identical.
+@metrics.timed("settle_simple_batch")
+def settle_simple_batch(cur, shard=0, n_shards=1, batch_size=BATCH_SIZE, tracker=None):
+    cur.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS settle_batch (
+            tx_id      UUID           PRIMARY KEY,
+            account_id UUID           NOT NULL,
+            amount     NUMERIC(18,2)  NOT NULL,
+            timestamp  TIMESTAMPTZ    NOT NULL,
+            ok         BOOLEAN        NOT NULL DEFAULT TRUE
+        ) ON COMMIT DELETE ROWS;
+    """)
+    # the earlier-transfer checks are index probes per candidate (see the
+    # idx_tx_pending_transfer_* indexes), so a call reads about batch_size rows
+    cur.execute("""
+        INSERT INTO settle_batch (tx_id, account_id, amount, timestamp)
+        SELECT tx.tx_id, tx.account_id, tx.amount, tx.timestamp
+        FROM banking.transaction tx
+        JOIN banking.account acc ON acc.account_id = tx.account_id
+        WHERE tx.status = 'pending' AND tx.target_id IS NULL
+          AND (hashtext(acc.customer_id::text) & 2147483647) %% %s = %s
+          AND NOT EXISTS (SELECT 1 FROM banking.tx_state s WHERE s.idempotency_key = tx.idempotency_key)
+          AND NOT EXISTS (SELECT 1 FROM banking.transaction t
+                          WHERE t.status = 'pending' AND t.target_id IS NOT NULL
+                            AND t.account_id = tx.account_id
+                            AND (t.timestamp, t.tx_id) < (tx.timestamp, tx.tx_id))
+          AND NOT EXISTS (SELECT 1 FROM banking.transaction t
+                          WHERE t.status = 'pending' AND t.target_id IS NOT NULL
+                            AND t.target_id = tx.account_id
+                            AND (t.timestamp, t.tx_id) < (tx.timestamp, tx.tx_id))
+        ORDER BY tx.timestamp, tx.tx_id
+        LIMIT %s
+        FOR UPDATE OF tx SKIP LOCKED;
+    """, (n_shards, shard, batch_size))
+    if cur.rowcount == 0:
+        return 0, 0
+
+    # Lock the affected accounts so balances cannot move while we settle
+    cur.execute("""
+        SELECT 1 FROM banking.account
+        WHERE account_id IN (SELECT account_id FROM settle_batch)
+        ORDER BY account_id
+        FOR UPDATE;
+    """)
+
+    # Fail the first overdrawing withdrawal per account until no running balance is negative
+    while True:
         cur.execute("""
-            SELECT tx_id, account_id, device_id, target_id, amount
-            FROM banking.transaction
-            WHERE status = 'pending';
+            UPDATE settle_batch s
+            SET ok = FALSE
+            FROM (
+                SELECT DISTINCT ON (account_id) tx_id
+                FROM (
+                    SELECT b.tx_id, b.account_id, b.timestamp,
+                           a.balance + SUM(b.amount) OVER (
+                               PARTITION BY b.account_id ORDER BY b.timestamp, b.tx_id) AS running
+                    FROM settle_batch b
+                    JOIN banking.account a ON a.account_id = b.account_id
+                    WHERE b.ok
+                ) r
+                WHERE running < 0
+                ORDER BY account_id, timestamp, tx_id
+            ) v
+            WHERE s.tx_id = v.tx_id;
         """)
-        rows = cur.fetchall()
-        if not rows:
-            logging.info("No pending transactions to process.")
+        if cur.rowcount == 0:
+            break
+
+    cur.execute("""
+        UPDATE banking.account a
+        SET balance = a.balance + d.delta
+        FROM (
+            SELECT account_id, SUM(amount) AS delta
+            FROM settle_batch
+            WHERE ok
+            GROUP BY account_id
+        ) d
+        WHERE a.account_id = d.account_id;
+    """)
+    cur.execute("""
+        UPDATE banking.transaction tx
+        SET status = CASE WHEN s.ok THEN 'success' ELSE 'failed' END
+        FROM settle_batch s
+        WHERE tx.tx_id = s.tx_id AND tx.timestamp = s.timestamp;
+    """)
+    if tracker is not None:
+        cur.execute("""
+            SELECT acc.customer_id, s.timestamp, s.amount
+            FROM settle_batch s
+            JOIN banking.account acc ON acc.account_id = s.account_id
+            WHERE s.ok;
+        """)
+        for customer_id, tx_time, amount in cur.fetchall():
+            tracker.record(cur, customer_id, tx_time, amount)
+    cur.execute("SELECT count(*) FILTER (WHERE ok), count(*) FILTER (WHERE NOT ok) FROM settle_batch;")
+    return cur.fetchone()
+
+# Settle claimed transactions server-side with banking.settle_transactions
+# (sql/settlement.sql) in one round-trip; authentication is simulated here.
+# Returns (succeeded, failed); rows hitting a database error stay pending.
+@metrics.timed("settle_with_procedure")
+def settle_with_procedure(cur, rows, tracker=None):
+    tx_ids = [tx[0] for tx in rows]
+    outcomes = [simulate_auth(tx_id) for tx_id in tx_ids]
+    cur.execute("""
+        SELECT tx_id, status, reason
+        FROM banking.settle_transactions(%s::uuid[], %s::boolean[], %s::text[]);
+    """, (tx_ids, [ok for ok, _ in outcomes], [method for _, method in outcomes]))
+    results = {str(tx_id): (status, reason) for tx_id, status, reason in cur.fetchall()}
+    succeeded = failed = 0
+    for tx_id, account_id, device_id, target_id, amount, tx_time, customer_id in rows:
+        status, reason = results.get(str(tx_id), (None, None))
+        if status == 'success':
+            succeeded += 1
+            if tracker is not None:
+                tracker.record(cur, customer_id, tx_time, amount)
+        elif status is not None:
+            logging.error(f"Transaction {tx_id} : {reason}")
+            failed += 1
+    return succeeded, failed
+
+# ---- Checkpointed processing -------------------------------------------------
+# Each claimed batch moves through the phases below, with one commit per phase
+# recorded in banking.process_checkpoint. A transaction's progress is kept in
+# banking.tx_state under its idempotency key, and every balance change goes
+# through banking.balance_ledger keyed (idempotency_key, step), in the same
+# database transaction as the state change. After a crash the next run claims
+# the still-pending transactions with their state and continues from there,
+# without repeating a debit, credit or audit row. The debit is committed before
+# authentication, so funds stay held once authentication starts; authentication
+# itself runs in the next phase's transaction, holding its row locks.
+
+# Record a balance change once per (idempotency_key, step). Returns False when
+# the account cannot cover it; True when applied now or by an earlier run.
+def apply_ledger(cur, key, step, account_id, amount):
+    cur.execute("SELECT 1 FROM banking.balance_ledger WHERE idempotency_key = %s AND step = %s;",
+                (key, step))
+    if cur.rowcount:
+        return True
+    update_account_balance(cur, account_id, amount)
+    if cur.rowcount == 0:
+        return False
+    cur.execute("""
+        INSERT INTO banking.balance_ledger (idempotency_key, step, account_id, amount)
+        VALUES (%s, %s, %s, %s);
+    """, (key, step, account_id, amount))
+    return True
+
+# Move a transaction from one state to the next; fails if another run moved it first.
+def advance_state(cur, key, expected, state):
+    cur.execute("""
+        UPDATE banking.tx_state SET state = %s, updated_at = now()
+        WHERE idempotency_key = %s AND state = %s;
+    """, (state, key, expected))
+    if cur.rowcount == 0:
+        raise RuntimeError(f"state of {key} is no longer {expected!r}")
+    return state
+
+def _fail(cur, tx, expected, reason, risk=None):
+    tx_id, tx_time, key = tx[0], tx[5], tx[7]
+    update_transaction_status(cur, tx_id, 'failed', tx_time)
+    if risk is not None:
+        generate_risk(cur, tx_id, *risk)
+    logging.error(f"Transaction {tx_id} : {reason}")
+    return advance_state(cur, key, expected, 'failed')
+
+def _settle(cur, tx, expected, tracker=None):
+    tx_id, account_id, device_id, target_id, amount, tx_time, customer_id, key, _ = tx
+    update_transaction_status(cur, tx_id, 'success', tx_time)
+    state = advance_state(cur, key, expected, 'settled')
+    if tracker is not None:
+        tracker.record(cur, customer_id, tx_time, amount)
+    return state
+
+# claimed -> debited (transfers), or settled/failed (deposits, withdrawals, rejected transfers)
+def debit_step(cur, tx, tracker, devices):
+    tx_id, account_id, device_id, target_id, amount, tx_time, customer_id, key, _ = tx
+    if target_id:
+        if devices is not None:
+            trusted = devices.is_trusted(cur, customer_id, account_id, device_id)
         else:
+            trusted = check_device_trust(cur, account_id, device_id)
+        if not trusted:
+            return _fail(cur, tx, 'claimed', f"Device {device_id} is not trusted.", (4, 'Untrusted device'))
+        if not apply_ledger(cur, key, 'debit', account_id, -amount):
+            return _fail(cur, tx, 'claimed', "Transfer Fail (insufficient balance)")
+        return advance_state(cur, key, 'claimed', 'debited')
+    if not apply_ledger(cur, key, 'apply', account_id, amount):
+        return _fail(cur, tx, 'claimed', "Withdrawal Fail (insufficient balance)")
+    return _settle(cur, tx, 'claimed', tracker)
+
+# debited -> authenticated, or failed with the debit refunded
+def authenticate_step(cur, tx, tracker, devices):
+    tx_id, account_id, device_id, target_id, amount, tx_time, customer_id, key, _ = tx
+    auth_ok, strong_method = simulate_auth(tx_id)
+    severity, auth_type = define_high_value_transaction(cur, tx_id, amount, tracker, customer_id, tx_time,
+                                                        strong_method)
+    execute_prepared(cur, "insert_auth_log", (str(uuid.uuid4()), tx_id, auth_type, auth_ok))
+    if auth_ok:
+        state = advance_state(cur, key, 'debited', 'authenticated')
+        if tracker is not None:         # counted now so later transfers of the batch see it
+            tracker.record(cur, customer_id, tx_time, amount)
+        return state
+    apply_ledger(cur, key, 'refund', account_id, amount)
+    risk = {2: (2, 'High value transaction'),
+            3: (3, 'Cumulative amount exceeds 20,000,000 VND')}.get(severity)
+    return _fail(cur, tx, 'debited', "Authentication Failed", risk)
+
+# authenticated -> settled
+def credit_step(cur, tx, tracker, devices):
+    tx_id, account_id, device_id, target_id, amount, tx_time, customer_id, key, _ = tx
+    apply_ledger(cur, key, 'credit', target_id, amount)
+    logging.info(f"Transaction {tx_id}: Transfer Success")
+    return _settle(cur, tx, 'authenticated')        # spend already counted when authenticated
+
+# (state a step starts from, step, phase the batch has reached after it)
+CHECKPOINT_PHASES = (
+    ('claimed',       debit_step,        'debited'),
+    ('debited',       authenticate_step, 'authenticated'),
+    ('authenticated', credit_step,       'settled'),
+)
+
+def read_checkpoint(cur, worker):
+    cur.execute("""
+        SELECT batch_id, phase, last_timestamp, processed, failed
+        FROM banking.process_checkpoint WHERE worker = %s;
+    """, (worker,))
+    return cur.fetchone()
+
+def save_checkpoint(cur, worker, batch_id, phase, last, processed, failed):
+    cur.execute("""
+        INSERT INTO banking.process_checkpoint
+            (worker, batch_id, phase, last_timestamp, last_tx_id, processed, failed)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (worker) DO UPDATE
+        SET batch_id = EXCLUDED.batch_id, phase = EXCLUDED.phase,
+            last_timestamp = EXCLUDED.last_timestamp, last_tx_id = EXCLUDED.last_tx_id,
+            processed = EXCLUDED.processed, failed = EXCLUDED.failed, updated_at = now();
+    """, (worker, batch_id, phase, last[5], last[0], processed, failed))
+
+# Claim the batch: new transactions enter tx_state as 'claimed'; transactions a
+# crashed run left behind keep their state and are resumed from it.
+def claim_checkpointed(cur, rows, worker, batch_id):
+    new = [tx for tx in rows if tx[8] is None]
+    if new:
+        cur.execute("""
+            INSERT INTO banking.tx_state (idempotency_key, tx_id, tx_time, state, worker, batch_id)
+            SELECT key, tx_id, tx_time, 'claimed', %s, %s
+            FROM unnest(%s::uuid[], %s::uuid[], %s::timestamptz[]) AS t(key, tx_id, tx_time)
+            ON CONFLICT (idempotency_key) DO NOTHING;
+        """, (worker, batch_id, [tx[7] for tx in new], [tx[0] for tx in new], [tx[5] for tx in new]))
+    resumed = len(rows) - len(new)
+    if resumed:
+        logging.info(f"{worker}: resuming {resumed} transaction(s) from their last checkpoint")
+    return {tx[7]: tx[8] or 'claimed' for tx in rows}
+
+# Process one shard in checkpointed batches; returns (processed, failed).
+# Each transaction step runs in a savepoint, so an error leaves that transaction
+# at its last state, still pending, for the next run.
+def process_checkpointed(conn, cur, shard=0, n_shards=1, batch_size=BATCH_SIZE, tracker=None, devices=None):
+    worker = f"shard-{shard}-of-{n_shards}"
+    checkpoint = read_checkpoint(cur, worker)
+    if checkpoint is not None and checkpoint[1] != 'settled':
+        logging.warning(f"{worker}: last run stopped in batch {checkpoint[0]} at phase {checkpoint[1]!r}")
+    processed = failed = errors = 0
+    for rows in iter_pending_batches(cur, shard, n_shards, batch_size, checkpointed=True):
+        batch_id = str(uuid.uuid4())
+        states = claim_checkpointed(cur, rows, worker, batch_id)
+        save_checkpoint(cur, worker, batch_id, 'claimed', rows[-1], processed, failed)
+        conn.commit()
+
+        for start, step, phase in CHECKPOINT_PHASES:
             for tx in rows:
+                key = tx[7]
+                if states[key] != start or not lock_pending(cur, tx[0], tx[5], checkpointed=True):
+                    continue
+                cur.execute("SAVEPOINT checkpoint_tx;")
                 try:
-                    process_transaction(conn, cur, tx)
+                    states[key] = step(cur, tx, tracker, devices)
                 except Exception as e:
+                    cur.execute("ROLLBACK TO SAVEPOINT checkpoint_tx;")
                     logging.error(f"Transaction {tx[0]} : {e}")
+                    metrics.increment("transactions", outcome="error", path="checkpointed")
+                    states[key] = None          # stays pending at its last committed state
+                    errors += 1
+                cur.execute("RELEASE SAVEPOINT checkpoint_tx;")
+            if phase == 'settled':
+                settled = sum(state == 'settled' for state in states.values())
+                rejected = sum(state == 'failed' for state in states.values())
+                processed += settled
+                failed += rejected + errors         # rows locked by another run are not counted
+                errors = 0
+                metrics.increment("transactions", settled, outcome="success", path="checkpointed")
+                metrics.increment("transactions", rejected, outcome="failed", path="checkpointed")
+            save_checkpoint(cur, worker, batch_id, phase, rows[-1], processed, failed)
+            with metrics.timer("commit"):
                 conn.commit()
-            cur.close()
-            print("All pending transactions processed successfully.")
\ No newline at end of file
+    return processed, failed
+
+# Process all pending transactions of one shard in batches, committing every
+# commit_every transactions. Each transaction runs in a savepoint: business
+# failures (ValueError) keep their status and audit rows, database errors roll
+# back just that transaction and leave it pending.
+# With batch_settlement, deposits and withdrawals are settled set-based first;
+# with procedure, each claimed batch is settled by the stored procedure instead;
+# with checkpointed, by process_checkpointed (commit_every does not apply there).
+# A long-running caller passes its tracker and device index to keep them warm.
+def process_pending(conn, shard=0, n_shards=1, batch_size=BATCH_SIZE, batch_settlement=False,
+                    tracker=None, devices=None, commit_every=COMMIT_EVERY, procedure=False,
+                    checkpointed=False):
+    if procedure and checkpointed:
+        raise ValueError("procedure and checkpointed settlement cannot be combined")
+    processed = failed = 0
+    uncommitted = 0
+    with conn.cursor() as cur:
+        if tracker is None:
+            tracker = DailySpendTracker(cur)
+            conn.commit()
+        if devices is None and not procedure:
+            devices = DeviceTrustIndex(conn)
+        while batch_settlement:
+            succeeded, rejected = settle_simple_batch(cur, shard, n_shards, batch_size, tracker)
+            conn.commit()
+            if not succeeded and not rejected:
+                break
+            logging.info(f"Shard {shard}/{n_shards}: settled {succeeded} deposits/withdrawals, {rejected} failed")
+            metrics.increment("transactions", succeeded, outcome="success", path="batch")
+            metrics.increment("transactions", rejected, outcome="failed", path="batch")
+            processed += succeeded
+            failed += rejected
+        if checkpointed:
+            succeeded, rejected = process_checkpointed(conn, cur, shard, n_shards, batch_size, tracker, devices)
+            conn.commit()
+            return processed + succeeded, failed + rejected
+        for rows in iter_pending_batches(cur, shard, n_shards, batch_size):
+            if procedure:
+                succeeded, rejected = settle_with_procedure(cur, rows, tracker)
+                conn.commit()
+                metrics.increment("transactions", succeeded, outcome="success", path="procedure")
+                metrics.increment("transactions", rejected, outcome="failed", path="procedure")
+                processed += succeeded
+                failed += rejected
+                continue
+            for tx in rows:
+                if not lock_pending(cur, tx[0], tx[5]):
+                    continue
+                cur.execute("SAVEPOINT pending_tx;")
+                try:
+                    process_transaction(conn, cur, tx, tracker, devices)
+                    metrics.increment("transactions", outcome="success", path="row")
+                    processed += 1
+                except psycopg2.Error as e:
+                    cur.execute("ROLLBACK TO SAVEPOINT pending_tx;")
+                    logging.error(f"Transaction {tx[0]} : {e}")
+                    metrics.increment("transactions", outcome="error", path="row")
+                    failed += 1
+                except Exception as e:
+                    logging.error(f"Transaction {tx[0]} : {e}")
+                    metrics.increment("transactions", outcome="failed", path="row")
+                    failed += 1
+                cur.execute("RELEASE SAVEPOINT pending_tx;")
+                uncommitted += 1
+                if uncommitted >= commit_every:
+                    with metrics.timer("commit"):
+                        conn.commit()
+                    uncommitted = 0
+            with metrics.timer("commit"):
+                conn.commit()
+            uncommitted = 0
+        conn.commit()
+    return processed, failed
+
+def _shard_slots(shard, n_shards):
+    if SHARD_SLOTS % n_shards:
+        raise ValueError(f"the number of shards must divide {SHARD_SLOTS}, got {n_shards}")
+    return list(range(shard, SHARD_SLOTS, n_shards))
+
+# Take the session-level advisory locks of a shard; False, holding none of them,
+# when another process (a stream worker, a DAG task) holds any.
+def lock_shard(conn, shard, n_shards):
+    slots = _shard_slots(shard, n_shards)
+    with conn.cursor() as cur:
+        cur.execute("SELECT slot, pg_try_advisory_lock(%s, slot) FROM unnest(%s::int[]) slot;",
+                    (SHARD_LOCK_CLASS, slots))
+        taken = [slot for slot, ok in cur.fetchall() if ok]
+        if len(taken) < len(slots):
+            cur.execute("SELECT pg_advisory_unlock(%s, slot) FROM unnest(%s::int[]) slot;",
+                        (SHARD_LOCK_CLASS, taken))
+    conn.commit()
+    return len(taken) == len(slots)
+
+def unlock_shard(conn, shard, n_shards):
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_unlock(%s, slot) FROM unnest(%s::int[]) slot;",
+                    (SHARD_LOCK_CLASS, _shard_slots(shard, n_shards)))
+    conn.commit()
+
+# Worker entry point: one pooled connection per shard. A shard owned by another
+# process is skipped. Returns the worker's metrics too so a parent process can
+# merge them.
+def run_worker(shard, n_shards, batch_size=BATCH_SIZE, batch_settlement=False, commit_every=COMMIT_EVERY,
+               procedure=False, checkpointed=False):
+    with pooled_connection() as conn:
+        if not lock_shard(conn, shard, n_shards):
+            logging.info(f"Shard {shard}/{n_shards}: owned by another process, skipped")
+            return 0, 0, metrics.snapshot()
+        try:
+            processed, failed = process_pending(conn, shard, n_shards, batch_size, batch_settlement,
+                                                commit_every=commit_every, procedure=procedure,
+                                                checkpointed=checkpointed)
+        finally:
+            if not conn.closed:
+                conn.rollback()
+                unlock_shard(conn, shard, n_shards)
+        logging.info(f"Shard {shard}/{n_shards}: {processed} succeeded, {failed} failed")
+        return processed, failed, metrics.snapshot()
+
+# Process the pending queue with N worker processes, each owning one shard.
+# Also the Airflow PythonOperator callable. Airflow starts a new process for
+# every task instance, so the pool does not outlive a run there; only the
+# long-lived stream service keeps its connections between drains.
+def run(workers=WORKERS, batch_size=BATCH_SIZE, batch_settlement=False, commit_every=COMMIT_EVERY,
+        procedure=False, checkpointed=False):
+    with pooled_connection() as conn:
+        with conn, conn.cursor() as cur:
+            ensure_partitions(cur)      # today's audit rows go to their own partition
+    if workers <= 1:
+        results = [run_worker(0, 1, batch_size, batch_settlement, commit_every, procedure, checkpointed)[:2]]
+    else:
+        # one shard per process: a reused process would report its earlier shard's
+        # metrics again in its snapshot
+        with multiprocessing.Pool(workers, maxtasksperchild=1) as pool:
+            results = pool.starmap(run_worker, [(shard, workers, batch_size, batch_settlement,
+                                                 commit_every, procedure, checkpointed)
+                                                for shard in range(workers)])
+        for _, _, worker_metrics in results:
+            metrics.merge(worker_metrics)
+    processed = sum(r[0] for r in results)
+    failed = sum(r[1] for r in results)
+    return processed, failed
+
+# Number of pending transactions, counted no further than limit so it stays cheap.
+def pending_backlog(cur, limit=MAX_BACKLOG):
+    cur.execute("""
+        SELECT count(*) FROM (
+            SELECT 1 FROM banking.transaction WHERE status = 'pending' LIMIT %s
+        ) p;
+    """, (limit,))
+    return cur.fetchone()[0]
+
+_stopping = False
+
+def _request_stop(signum, frame):
+    global _stopping
+    _stopping = True
+
+# Long-running processor for one shard: waits until it owns the shard, then
+# holds it and drains the pending queue in micro-batches,
+# then sleeps until a NOTIFY banking_tx_pending (sent by a trigger on every insert
+# into banking.transaction) or until poll_seconds pass, whichever comes first.
+# With metrics enabled each shard serves them on METRICS_PORT + shard and
+# rewrites its own textfile after every drain.
+def stream_worker(shard=0, n_shards=1, batch_size=BATCH_SIZE, batch_settlement=False,
+                  poll_seconds=STREAM_POLL_SECONDS, max_backlog=MAX_BACKLOG, commit_every=COMMIT_EVERY,
+                  procedure=False, checkpointed=False):
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+    if metrics.PORT:
+        metrics.serve(metrics.PORT + shard)
+    listener = connect_db()
+    listener.autocommit = True
+    with listener.cursor() as cur:
+        cur.execute("LISTEN banking_tx_pending;")
+    conn = connect_db()
+    try:
+        while not lock_shard(conn, shard, n_shards):
+            if _stopping:
+                return
+            logging.info(f"Shard {shard}/{n_shards}: owned by another process, waiting")
+            time.sleep(poll_seconds)
+        with conn.cursor() as cur:
+            tracker = DailySpendTracker(cur)      # warmed once the shard is ours
+        conn.commit()
+        devices = None if procedure else DeviceTrustIndex(conn)
+        logging.info(f"Shard {shard}/{n_shards}: streaming pending transactions")
+        while not _stopping:
+            start = time.monotonic()
+            processed, failed = process_pending(conn, shard, n_shards, batch_size, batch_settlement,
+                                                tracker, devices, commit_every, procedure, checkpointed)
+            if processed or failed:
+                with conn.cursor() as cur:
+                    backlog = pending_backlog(cur, max_backlog)
+                conn.commit()
+                level = logging.WARNING if backlog >= max_backlog else logging.INFO
+                logging.log(level, f"Shard {shard}/{n_shards}: {processed} succeeded, {failed} failed "
+                                   f"in {time.monotonic() - start:.3f}s, backlog "
+                                   f"{'>=' if backlog >= max_backlog else ''}{backlog}")
+                metrics.write_textfile(suffix=f"stream-{shard}")
+                if processed and backlog:
+                    continue        # more work queued; rows stuck on errors wait for the next wake-up
+            # queue drained: wait for the next insert, polling as a fallback
+            if select.select([listener], [], [], poll_seconds) != ([], [], []):
+                listener.poll()
+                listener.notifies.clear()
+    finally:
+        conn.close()
+        listener.close()
+
+# Streaming mode with N worker processes, one shard each.
+def stream(workers=WORKERS, batch_size=BATCH_SIZE, batch_settlement=False, commit_every=COMMIT_EVERY,
+           procedure=False, checkpointed=False):
+    with pooled_connection() as conn:
+        with conn, conn.cursor() as cur:
+            ensure_partitions(cur)
+    if workers <= 1:
+        stream_worker(0, 1, batch_size, batch_settlement, commit_every=commit_every, procedure=procedure,
+                      checkpointed=checkpointed)
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            pool.starmap(stream_worker, [(shard, workers, batch_size, batch_settlement,
+                                          STREAM_POLL_SECONDS, MAX_BACKLOG, commit_every, procedure,
+                                          checkpointed)
+                                         for shard in range(workers)])
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Process pending banking transactions.")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help=f"number of worker processes, each with its own connection and shard "
+                             f"(must divide {SHARD_SLOTS})")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="pending transactions claimed per query")
+    parser.add_argument("--batch-settlement", action="store_true",
+                        help="settle deposits/withdrawals with set-based SQL before row-by-row transfers")
+    parser.add_argument("--commit-every", type=int, default=COMMIT_EVERY,
+                        help="transactions grouped into one commit (1 commits each one)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--procedure", action="store_true",
+                      help="settle each claimed batch with the banking.settle_transactions stored procedure")
+    mode.add_argument("--checkpointed", action="store_true",
+                      help="settle through idempotent, checkpointed phases that resume after a crash")
+    parser.add_argument("--stream", action="store_true",
+                        help="keep running and process new transactions as they arrive (LISTEN/NOTIFY)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.stream:
+        stream(args.workers, args.batch_size, args.batch_settlement, args.commit_every, args.procedure,
+               args.checkpointed)
+        raise SystemExit(0)
+    processed, failed = run(args.workers, args.batch_size, args.batch_settlement, args.commit_every,
+                            args.procedure, args.checkpointed)
+    metrics.write_textfile(suffix="processing")
+    if not processed and not failed:
+        logging.info("No pending transactions to process.")
+    else:
+        print("All pending transactions processed successfully.")
@@ -0,0 +1,50 @@
+"""
+partitions.py
+
+Creates upcoming partitions of the time-partitioned banking tables and
+archives partitions past the retention period (see sql/schema.sql).
+"""
+
+import os
+import argparse
+import logging
+from db import connect_db
+
+DAYS_AHEAD = int(os.getenv("PARTITION_DAYS_AHEAD", 7))
+RETENTION  = os.getenv("PARTITION_RETENTION", "90 days")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s %(levelname)s %(message)s",
+    handlers=[logging.StreamHandler()]
+)
+
+# Make sure partitions exist for today and the next days_ahead days.
+def ensure_partitions(cur, days_ahead=DAYS_AHEAD):
+    cur.execute("SELECT banking.ensure_partitions(%s);", (days_ahead,))
+
+# Detach partitions older than the retention period into banking_archive.
+def archive_partitions(cur, retention=RETENTION):
+    cur.execute("SELECT banking.archive_partitions(%s::interval);", (retention,))
+    return [name for (name,) in cur.fetchall()]
+
+# Create upcoming partitions and optionally archive old ones; returns the archived names.
+def maintain_partitions(days_ahead=DAYS_AHEAD, archive=False, retention=RETENTION):
+    archived = []
+    conn = connect_db()
+    with conn:
+        with conn.cursor() as cur:
+            ensure_partitions(cur, days_ahead)
+            if archive:
+                archived = archive_partitions(cur, retention)
+                logging.info(f"Archived {len(archived)} partition(s): {', '.join(archived) or '-'}")
+    conn.close()
+    return archived
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain partitions of the banking tables.")
+    parser.add_argument("--days-ahead", type=int, default=DAYS_AHEAD)
+    parser.add_argument("--archive", action="store_true", help="also archive partitions past retention")
+    parser.add_argument("--retention", default=RETENTION)
+    args = parser.parse_args()
+    maintain_partitions(args.days_ahead, args.archive, args.retention)
@@ -0,0 +1,211 @@
+"""
+risk_scoring.py
+
+Batch risk scoring over a window of recent transactions. Where
+monitoring_audit.py applies per-row rules, this stage loads the whole window
+into pandas/NumPy columns and tags anomalies with vectorized features:
+
+  - velocity:    more than VELOCITY_LIMIT transactions of an account in one minute
+  - amount:      z-score of abs(amount) against the account's history above Z_LIMIT
+  - new device:  share of a customer's transfers made from devices first seen in
+                 the last NEW_DEVICE_DAYS at or above NEW_DEVICE_RATIO
+  - fan-out:     transfers to more than FANOUT_LIMIT distinct accounts in the window
+
+Windows run from the watermark (job 'risk_scoring' in banking.watermark) to
+now() - RISK_LAG, at most RISK_MAX_WINDOW each, and are read with one COPY.
+Account history is kept as running count/mean/M2 in
+banking.account_amount_stats and merged with each window, so the z-score never
+rescans old transactions. Tags, stats and the
+watermark are written in one transaction, risk_tag rows with COPY.
+"""
+
+import os
+import io
+import logging
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+import metrics
+from db import pooled_connection
+from watermarks import ensure_watermarks, read_watermark, save_watermark
+
+WATERMARK_JOB    = "risk_scoring"
+RISK_LAG         = os.getenv("RISK_LAG", "5 minutes")
+MAX_WINDOW       = os.getenv("RISK_MAX_WINDOW", "1 day")       # longest window scored at once
+VELOCITY_LIMIT   = int(os.getenv("RISK_VELOCITY_LIMIT", 5))     # tx per account per minute
+Z_LIMIT          = float(os.getenv("RISK_Z_LIMIT", 3.0))
+MIN_HISTORY      = int(os.getenv("RISK_MIN_HISTORY", 10))       # tx needed before z-scores count
+NEW_DEVICE_DAYS  = int(os.getenv("RISK_NEW_DEVICE_DAYS", 7))
+NEW_DEVICE_RATIO = float(os.getenv("RISK_NEW_DEVICE_RATIO", 0.5))
+MIN_TRANSFERS    = int(os.getenv("RISK_MIN_TRANSFERS", 3))      # transfers needed for the device ratio
+FANOUT_LIMIT     = int(os.getenv("RISK_FANOUT_LIMIT", 10))
+
+# tag_reason -> severity (4 stays reserved for untrusted devices)
+TAGS = {
+    "High transaction velocity":  3,
+    "Unusual amount for account": 2,
+    "Transfers from new devices": 2,
+    "Transfers to many accounts": 3,
+}
+
+WINDOW_COLUMNS = ["tx_id", "account_id", "customer_id", "target_id", "ts", "amount",
+                  "new_device", "n", "mean", "m2"]
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s %(levelname)s %(message)s",
+    handlers=[logging.StreamHandler()]
+)
+
+# Load the window with one COPY; each row carries the account's running stats.
+# new_device is NULL for transactions without a registered device of the customer.
+def load_window(cur, since, until):
+    query = cur.mogrify("""
+        COPY (
+            SELECT tx.tx_id, tx.account_id, acc.customer_id, tx.target_id,
+                   extract(epoch FROM tx.timestamp)::bigint,
+                   abs(tx.amount)::float8,
+                   d.first_seen > tx.timestamp - make_interval(days => %(days)s),
+                   s.n, s.mean, s.m2
+            FROM banking.transaction tx
+            JOIN banking.account acc ON acc.account_id = tx.account_id
+            LEFT JOIN banking.device d ON d.device_id = tx.device_id AND d.customer_id = acc.customer_id
+            LEFT JOIN banking.account_amount_stats s ON s.account_id = tx.account_id
+            WHERE tx.timestamp > %(since)s AND tx.timestamp <= %(until)s
+        ) TO STDOUT WITH (FORMAT csv)
+    """, {"since": since, "until": until, "days": NEW_DEVICE_DAYS}).decode()
+    with tempfile.TemporaryFile(mode="w+b") as spool:
+        cur.copy_expert(query, spool)
+        spool.seek(0)
+        return pd.read_csv(spool, names=WINDOW_COLUMNS, header=None,
+                           dtype={"tx_id": str, "account_id": str, "customer_id": str, "target_id": str,
+                                  "ts": np.int64, "amount": np.float64, "new_device": object,
+                                  "n": np.float64, "mean": np.float64, "m2": np.float64})
+
+# Vectorized features; returns a frame of (tx_id, tag_reason) to tag.
+def score(df):
+    flagged = []
+
+    # velocity: transactions in the same account-minute
+    per_minute = df.groupby([df["account_id"], df["ts"] // 60])["tx_id"].transform("size")
+    flagged.append(("High transaction velocity", per_minute.to_numpy() > VELOCITY_LIMIT))
+
+    # amount z-score against the account's history (before this window)
+    n = df["n"].fillna(0).to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        std = np.sqrt(df["m2"].to_numpy() / (n - 1))
+        z = (df["amount"].to_numpy() - df["mean"].to_numpy()) / std
+    flagged.append(("Unusual amount for account", (n >= MIN_HISTORY) & (std > 0) & (z > Z_LIMIT)))
+
+    # new-device ratio over each customer's transfers from registered devices
+    transfer = df["target_id"].notna().to_numpy()
+    new_device = df["new_device"].map({"t": 1.0, "f": 0.0}).to_numpy()   # NaN: no registered device
+    known = transfer & ~np.isnan(new_device)
+    devices = pd.DataFrame({"customer_id": df["customer_id"][known], "new": new_device[known]})
+    per_customer = devices.groupby("customer_id")["new"].agg(["mean", "size"])
+    ratio = df["customer_id"].map(per_customer["mean"]).to_numpy()
+    count = df["customer_id"].map(per_customer["size"]).fillna(0).to_numpy()
+    flagged.append(("Transfers from new devices",
+                    known & (new_device == 1) & (count >= MIN_TRANSFERS) & (ratio >= NEW_DEVICE_RATIO)))
+
+    # fan-out: the transfers that reach a new target beyond the limit, in time order
+    order = np.argsort(df["ts"].to_numpy(), kind="stable")
+    transfers = df.iloc[order][transfer[order]]
+    first_target = ~transfers.duplicated(["account_id", "target_id"])
+    rank = first_target.groupby(transfers["account_id"]).cumsum()
+    fanout = np.zeros(len(df), dtype=bool)
+    fanout[order[transfer[order]]] = (first_target & (rank > FANOUT_LIMIT)).to_numpy()
+    flagged.append(("Transfers to many accounts", fanout))
+
+    return pd.concat([pd.DataFrame({"tx_id": df["tx_id"][mask], "tag_reason": reason})
+                      for reason, mask in flagged], ignore_index=True)
+
+# COPY the tags straight into risk_tag (risk_id and flagged_at use their defaults).
+def write_tags(cur, tags):
+    buf = io.StringIO()
+    out = tags.assign(severity=tags["tag_reason"].map(TAGS))
+    out[["tx_id", "severity", "tag_reason"]].to_csv(buf, index=False, header=False)
+    buf.seek(0)
+    cur.copy_expert("COPY banking.risk_tag (tx_id, severity, tag_reason) FROM STDIN WITH (FORMAT csv)", buf)
+
+# Merge the window's per-account count/mean/M2 into the running stats
+# (parallel variance formula), so the next window is scored against them.
+def merge_stats(cur, df):
+    window = df.groupby("account_id")["amount"].agg(["size", "mean", "var"])
+    window["m2"] = window["var"].fillna(0) * (window["size"] - 1)
+    buf = io.StringIO()
+    window[["size", "mean", "m2"]].to_csv(buf, header=False)
+    buf.seek(0)
+    cur.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS _window_stats (
+            account_id UUID, n BIGINT, mean DOUBLE PRECISION, m2 DOUBLE PRECISION
+        ) ON COMMIT DELETE ROWS;
+    """)
+    cur.copy_expert("COPY _window_stats FROM STDIN WITH (FORMAT csv)", buf)
+    cur.execute("""
+        INSERT INTO banking.account_amount_stats AS s (account_id, n, mean, m2)
+        SELECT account_id, n, mean, m2 FROM _window_stats
+        ON CONFLICT (account_id) DO UPDATE
+        SET n    = s.n + EXCLUDED.n,
+            mean = s.mean + (EXCLUDED.mean - s.mean) * EXCLUDED.n / (s.n + EXCLUDED.n),
+            m2   = s.m2 + EXCLUDED.m2
+                   + (EXCLUDED.mean - s.mean) ^ 2 * s.n * EXCLUDED.n / (s.n + EXCLUDED.n),
+            updated_at = now();
+    """)
+
+# Score one window of at most max_window after the watermark; returns
+# (transactions scored, tag counts, whether the window reached now() - lag).
+def score_window(conn, cur, lag=RISK_LAG, max_window=MAX_WINDOW):
+    since, _ = read_watermark(cur, WATERMARK_JOB, "transaction")
+    cur.execute("SELECT now() - %s::interval, now() - %s::interval - %s::interval;",
+                (lag, lag, max_window))
+    latest, first_since = cur.fetchone()
+    since = first_since if since is None else since      # first run: only the last max_window
+    cur.execute("SELECT least(%s, %s + %s::interval);", (latest, since, max_window))
+    until = cur.fetchone()[0]
+    if until <= since:
+        conn.commit()
+        return 0, {}, True
+
+    with metrics.timer("risk_load_window"):
+        df = load_window(cur, since, until)
+    with metrics.timer("risk_score_window"):
+        tags = score(df) if len(df) else pd.DataFrame(columns=["tx_id", "tag_reason"])
+    with metrics.timer("risk_write_tags"):
+        if len(tags):
+            write_tags(cur, tags)
+        if len(df):
+            merge_stats(cur, df)
+        save_watermark(cur, WATERMARK_JOB, "transaction", until)
+    conn.commit()
+
+    counts = tags["tag_reason"].value_counts().to_dict()
+    logging.info(f"Scored {len(df)} transaction(s) in ({since}, {until}]: {counts or 'no anomalies'}")
+    return len(df), counts, until >= latest
+
+# Score everything since the watermark, one window of at most max_window at a
+# time, so a late or failed run is caught up rather than skipped; also the
+# Airflow task callable. Returns a summary for XCom.
+def run_scoring(lag=RISK_LAG, max_window=MAX_WINDOW):
+    scored, counts = 0, {}
+    with pooled_connection() as conn, conn.cursor() as cur:
+        ensure_watermarks(cur)
+        conn.commit()
+        done = False
+        while not done:
+            n, window_counts, done = score_window(conn, cur, lag, max_window)
+            scored += n
+            for reason, count in window_counts.items():
+                counts[reason] = counts.get(reason, 0) + count
+    for reason, count in counts.items():
+        metrics.increment("risk_tags", count, reason=reason)
+    return {"transactions": scored, "tags": counts}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vectorized risk scoring of recent transactions.")
+    parser.add_argument("--lag", default=RISK_LAG, help="only score transactions older than this interval")
+    parser.add_argument("--max-window", default=MAX_WINDOW, help="longest window scored at once")
+    args = parser.parse_args()
+    run_scoring(args.lag, args.max_window)
+    metrics.write_textfile(suffix="risk_scoring")
@@ -0,0 +1,203 @@
+"""
+synthetic_data.py
+
+Vectorized synthetic data generator: builds whole columns at once with NumPy
+instead of calling Faker/random per field per row.
+"""
+
+from collections import namedtuple
+from datetime import date
+import numpy as np
+from faker import Faker
+
+# accounts/devices per customer are (low, high) inclusive ranges
+Scale = namedtuple("Scale", "customers accounts_per_customer devices_per_customer transactions")
+
+SCALES = {
+    "small":  Scale(1_000,     (1, 3), (1, 2), 1_000),
+    "medium": Scale(100_000,   (1, 3), (1, 2), 1_000_000),
+    "large":  Scale(1_000_000, (1, 3), (1, 2), 10_000_000),
+}
+
+TX_TYPES     = np.array(["deposit", "withdrawal", "transfer"])
+TX_WEIGHTS   = [0.2, 0.3, 0.5]
+METHODS      = np.array(["online", "card", "cash"])
+ACC_TYPES    = np.array(["savings", "checking"])
+DEVICE_TYPES = np.array(["desktop", "mobile"])
+PHONE_PREFIXES = np.array(["32", "33", "34", "35", "36", "37", "38", "39", "70", "76",
+                           "77", "78", "79", "81", "82", "83", "84", "85", "86", "88",
+                           "89", "90", "91", "93", "94", "96", "97", "98"])
+NAME_POOL_SIZE = 10_000
+
+_HEX = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+# parse a preset name or "customers=..,accounts=1-3,devices=1-2,transactions=.."
+def parse_scale(value):
+    if value in SCALES:
+        return SCALES[value]
+    scale = SCALES["small"]._asdict()
+    keys = {"customers": "customers", "accounts": "accounts_per_customer",
+            "devices": "devices_per_customer", "transactions": "transactions"}
+    for part in value.split(","):
+        key, _, raw = part.partition("=")
+        if key.strip() not in keys:
+            raise ValueError(f"Unknown scale field {key!r}, expected a preset {list(SCALES)} or {list(keys)}")
+        field = keys[key.strip()]
+        if field.endswith("_per_customer"):
+            low, _, high = raw.partition("-")
+            scale[field] = (int(low), int(high or low))
+        else:
+            scale[field] = int(raw)
+    return Scale(**scale)
+
+# n random version-4 UUIDs as a fixed-width bytes array (S36)
+def uuid4_array(rng, n):
+    raw = rng.integers(0, 256, size=(n, 16), dtype=np.uint8)
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+    hexed = np.empty((n, 32), dtype=np.uint8)
+    hexed[:, 0::2] = _HEX[raw >> 4]
+    hexed[:, 1::2] = _HEX[raw & 0x0F]
+    out = np.full((n, 36), ord("-"), dtype=np.uint8)
+    out[:, 0:8]   = hexed[:, 0:8]
+    out[:, 9:13]  = hexed[:, 8:12]
+    out[:, 14:18] = hexed[:, 12:16]
+    out[:, 19:23] = hexed[:, 16:20]
+    out[:, 24:36] = hexed[:, 20:32]
+    return out.view("S36").ravel()
+
+# repeat each parent index a random number of times in [low, high]
+def _fan_out(rng, n_parents, low, high):
+    counts = rng.integers(low, high + 1, size=n_parents)
+    return np.repeat(np.arange(n_parents), counts), counts
+
+def _join(*parts):
+    out = parts[0]
+    for part in parts[1:]:
+        out = np.char.add(out, part)
+    return out
+
+# customer columns: names drawn from a pre-generated Faker pool, unique phone numbers
+def customer_columns(rng, n, seed=None):
+    fake = Faker("vi_VN")
+    fake.seed_instance(seed)
+    names = np.array([fake.name() for _ in range(min(n, NAME_POOL_SIZE))])
+    today = np.datetime64(date.today(), "D")
+    birth = today - rng.integers(18 * 365, 80 * 365, size=n).astype("timedelta64[D]")
+    id_number = np.char.zfill(rng.integers(0, 10**12, size=n).astype("U12"), 12)
+    phone = rng.choice(len(PHONE_PREFIXES) * 10**7, size=n, replace=False)
+    contact = _join("0", PHONE_PREFIXES[phone // 10**7],
+                    np.char.zfill((phone % 10**7).astype("U7"), 7))
+    return {
+        "customer_id": uuid4_array(rng, n),
+        "full_name":   names[rng.integers(0, len(names), size=n)],
+        "birth_date":  birth,
+        "id_number":   id_number,
+        "contact":     contact,
+    }
+
+def account_columns(rng, customer_ids, low, high):
+    owner, _ = _fan_out(rng, len(customer_ids), low, high)
+    n = len(owner)
+    return {
+        "account_id":  uuid4_array(rng, n),
+        "customer_id": customer_ids[owner],
+        "type":        ACC_TYPES[rng.integers(0, len(ACC_TYPES), size=n)],
+        "balance":     rng.uniform(0, 1e8, size=n).round(2),
+    }, owner
+
+def device_columns(rng, customer_ids, low, high):
+    owner, counts = _fan_out(rng, len(customer_ids), low, high)
+    n = len(owner)
+    octets = [rng.integers(11, 224, size=n)] + [rng.integers(0, 256, size=n) for _ in range(3)]
+    octets = [o.astype("U3") for o in octets]
+    return {
+        "device_id":   uuid4_array(rng, n),
+        "customer_id": customer_ids[owner],
+        "device_type": DEVICE_TYPES[rng.integers(0, len(DEVICE_TYPES), size=n)],
+        "ip_address":  _join(octets[0], ".", octets[1], ".", octets[2], ".", octets[3]),
+    }, counts
+
+# pending transactions over existing accounts.
+# account_owner maps account -> customer index, device_count[c] is the number of
+# devices of customer c, stored contiguously from device_start[c] in device_ids.
+def transaction_columns(rng, n, account_ids, account_owner, device_ids, device_start, device_count):
+    n_acc = len(account_ids)
+    src = rng.integers(0, n_acc, size=n)
+    tx_type = rng.choice(len(TX_TYPES), size=n, p=TX_WEIGHTS)
+    amount = rng.uniform(10_000, 15_000_000, size=n).round(0)
+    amount[tx_type == 1] *= -1                               # negative for withdrawal
+
+    transfer = tx_type == 2
+    n_tr = int(transfer.sum())
+    # target is any other account: draw from n_acc - 1 slots and skip the source
+    target = rng.integers(0, max(n_acc - 1, 1), size=n_tr)
+    target += target >= src[transfer]
+    target_id = np.full(n, b"", dtype="S36")
+    target_id[transfer] = account_ids[target]
+
+    # transfers use one of the owner's devices 80% of the time, an unknown one otherwise
+    owner = account_owner[src[transfer]]
+    own = device_ids[device_start[owner] + (rng.random(n_tr) * device_count[owner]).astype(np.int64)]
+    device_id = np.full(n, b"", dtype="S36")
+    device_id[transfer] = np.where(rng.random(n_tr) < 0.8, own, uuid4_array(rng, n_tr))
+
+    return {
+        "tx_id":      uuid4_array(rng, n),
+        "account_id": account_ids[src],
+        "device_id":  device_id,
+        "target_id":  target_id,
+        "amount":     amount,
+        "method":     METHODS[rng.integers(0, len(METHODS), size=n)],
+        "status":     np.full(n, "pending"),
+    }
+
+# whole dataset for a scale; returns {table: columns}
+def generate_dataset(scale, seed=None):
+    rng = np.random.default_rng(seed)
+    customers = customer_columns(rng, scale.customers, seed)
+    accounts, account_owner = account_columns(rng, customers["customer_id"], *scale.accounts_per_customer)
+    devices, device_count = device_columns(rng, customers["customer_id"], *scale.devices_per_customer)
+    device_start = np.cumsum(device_count) - device_count
+    transactions = transaction_columns(rng, scale.transactions, accounts["account_id"], account_owner,
+                                       devices["device_id"], device_start, device_count)
+    return {
+        "customer":    customers,
+        "account":     accounts,
+        "device":      devices,
+        "transaction": transactions,
+    }
+
+# Remove customers (boolean mask over the customer rows) with their accounts,
+# devices and every transaction from or to their accounts, so what remains
+# loads without foreign key violations.
+def drop_customers(dataset, mask):
+    if not mask.any():
+        return dataset
+    def keep(columns, rows):
+        return {name: values[rows] for name, values in columns.items()}
+    customers, accounts = dataset["customer"], dataset["account"]
+    dropped = customers["customer_id"][mask]
+    dropped_accounts = accounts["account_id"][np.isin(accounts["customer_id"], dropped)]
+    tx = dataset["transaction"]
+    return {
+        "customer":    keep(customers, ~mask),
+        "account":     keep(accounts, ~np.isin(accounts["customer_id"], dropped)),
+        "device":      keep(dataset["device"], ~np.isin(dataset["device"]["customer_id"], dropped)),
+        "transaction": keep(tx, ~(np.isin(tx["account_id"], dropped_accounts)
+                                  | np.isin(tx["target_id"], dropped_accounts))),
+    }
+
+# turn columns into row tuples chunk by chunk; empty bytes become NULL
+def iter_rows(columns, chunk_size=100_000):
+    arrays = list(columns.values())
+    n = len(arrays[0])
+    for start in range(0, n, chunk_size):
+        chunk = []
+        for arr in arrays:
+            part = arr[start:start + chunk_size]
+            if part.dtype.kind == "S":
+                chunk.append([v.decode() or None for v in part.tolist()])
+            else:
+                chunk.append(part.tolist())
+        yield from zip(*chunk)
@@ -0,0 +1,37 @@
+"""
+watermarks.py
+
+High-water marks of the incremental jobs (data quality checks, risk scoring,
+Parquet export), one row per (job, table) in banking.watermark.
+"""
+
+# Watermark table shared by incremental jobs; also created by sql/schema.sql.
+def ensure_watermarks(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS banking.watermark (
+          job           TEXT          NOT NULL,
+          table_name    TEXT          NOT NULL,
+          high_water    TIMESTAMPTZ   NOT NULL,
+          last_full_run TIMESTAMPTZ,
+          updated_at    TIMESTAMPTZ   NOT NULL DEFAULT now(),
+          PRIMARY KEY (job, table_name)
+        );
+    """)
+
+# Return (high_water, last_full_run) of a job's table, or (None, None).
+def read_watermark(cur, job, table):
+    cur.execute("""
+        SELECT high_water, last_full_run FROM banking.watermark
+        WHERE job = %s AND table_name = %s;
+    """, (job, table))
+    return cur.fetchone() or (None, None)
+
+def save_watermark(cur, job, table, high_water, full_run=False):
+    cur.execute("""
+        INSERT INTO banking.watermark (job, table_name, high_water, last_full_run)
+        VALUES (%(job)s, %(table)s, %(high_water)s, CASE WHEN %(full)s THEN now() END)
+        ON CONFLICT (job, table_name) DO UPDATE
+        SET high_water    = EXCLUDED.high_water,
+            last_full_run = COALESCE(EXCLUDED.last_full_run, banking.watermark.last_full_run),
+            updated_at    = now();
+    """, {"job": job, "table": table, "high_water": high_water, "full": full_run})
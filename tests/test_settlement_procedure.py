@@ -0,0 +1,64 @@
+"""
+Settling the same seeded data with the Python processor and with the
+banking.settle_transactions stored procedure (sql/settlement.sql) must give the
+same transaction statuses, balances, auth_log and risk_tag rows.
+
+Runs against a throwaway PostgreSQL cluster set up by benchmarks/run_benchmarks.py
+(as PG_OS_USER through runuser when the suite runs as root); skipped when
+initdb is not available.
+"""
+
+import os
+import sys
+import pytest
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("numpy")
+pytest.importorskip("faker")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+import run_benchmarks as bench
+
+SEED  = 42
+SCALE = "customers=300,accounts=1-3,devices=1-2,transactions=3000"
+
+pytestmark = pytest.mark.skipif(not bench.can_start_cluster(),
+                                reason="needs PostgreSQL binaries (initdb), and runuser when run as root")
+
+@pytest.fixture(scope="module")
+def seeded():
+    with bench.local_postgres() as port:
+        generate_data, monitoring_audit, _ = bench.load_modules()
+        from synthetic_data import parse_scale
+        bench.reset_database(port)
+        bench.bench_generation(generate_data, parse_scale(SCALE), SEED)
+        bench.save_as_template(port)
+        yield port, monitoring_audit
+        import db
+        db.close_pool()
+
+# Settle the seed database with one path and return its outcome rows.
+def settle(port, monitoring_audit, procedure):
+    bench.reset_database(port, bench.SEED_DB)
+    monitoring_audit.run(1, monitoring_audit.BATCH_SIZE, procedure=procedure)
+    return bench.settlement_outcome()
+
+@pytest.fixture(scope="module")
+def outcomes(seeded):
+    port, monitoring_audit = seeded
+    monitoring_audit.AUTH_SEED = str(SEED)     # same authentication results on both paths
+    try:
+        return settle(port, monitoring_audit, False), settle(port, monitoring_audit, True)
+    finally:
+        monitoring_audit.AUTH_SEED = None
+
+def test_every_transaction_is_settled(outcomes):
+    python, stored = outcomes
+    assert not [tx for tx, status in python["transaction"] if status == "pending"]
+    assert not [tx for tx, status in stored["transaction"] if status == "pending"]
+
+@pytest.mark.parametrize("table", list(bench.OUTCOME_QUERIES))
+def test_procedure_matches_python_path(outcomes, table):
+    python, stored = outcomes
+    assert stored[table] == python[table]